@@ -1,164 +1,437 @@
-import base64
+import threading
 from collections import Counter
-from io import BytesIO
 
-import mysql.connector
-import pandas as pd
-from PIL import Image
-from tqdm import tqdm
-from ultralytics import YOLO
+import cv2
+import numpy as np
 
+import backends
 import config
+from cache import InferenceCache
+from catalog import price_catalog
+import imaging
+import metrics
+from imaging import UploadedImage
 
-
-def get_db_connection():
-    return mysql.connector.connect(**config.credentials)
+# Most parts a car can have of each kind; detections beyond this are not counted or billed.
+# config.detection overrides them per brand or model, see max_counts_for.
+MAX_COUNTS = {
+    'Bonnet': 1,
+    'Bumper': 1,
+    'Dickey': 1,
+    'Door': 4,
+    'Fender': 4,
+    'Light': 4,
+    'Windshield': 2
+}
 
 class YOLOModel:
-    def __init__(self, model_path = r"..\\Accident-Car-Damage-Detection\\flask\\model weights\\weights\\best.pt", image_path = None):
-        """Initialize the YOLO model with the given path."""
-        self.model = YOLO(model_path)
+    def __init__(self, model_path = None):
+        """Load the YOLO weights. One instance is shared by every request in the worker."""
+        # torch and ultralytics are only imported once a model is actually loaded
+        from ultralytics import YOLO
+
+        # An exported ONNX / OpenVINO model loads behind the same YOLO API as best.pt
+        self.model_path = model_path or backends.resolve_weights()
+        self.model = YOLO(self.model_path, task='detect')
         self.class_names = self.model.names
-        self.db_connection = get_db_connection()
-        self.image_path = image_path
-        self.max_counts = {
-            'Bonnet': 1,
-            'Bumper': 1,
-            'Dickey': 1,
-            'Door': 4,
-            'Fender': 4,
-            'Light': 4,
-            'Windshield': 2
-        }
-
-    def predict(self):
-        """Make predictions on a single image path with progress tracking."""
-        # Wrap the single image processing in tqdm for progress indication
-        with tqdm(total=1, desc="Processing image") as pbar:
-            self.output = self.model(self.image_path)
-            pbar.update(1)
-        return self.output
+        self.max_counts = dict(MAX_COUNTS)
+        # The ultralytics predictor keeps internal state, so forward passes are serialized
+        self._lock = threading.Lock()
+        # Cached detections are only valid for the weights that produced them
+        self.weights_version = backends.weights_version(self.model_path)
+        self.cache = InferenceCache() if config.inference_cache['enabled'] else None
+
+    def warmup(self, size = None):
+        """Run a dummy forward pass so the first real request does not pay for lazy initialisation."""
+        size = size or config.yolo['warmup_size']
+        with self._lock:
+            self.model(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+
+    def predict(self, image, tiled = None):
+        """Make predictions on a single image (path or decoded upload)."""
+        return self.predict_batch([image], tiled)[0]
+
+    def predict_batch(self, images, tiled = None):
+        """Run one batched forward pass over several images and return a Prediction per image.
+
+        Images whose detections are already cached skip the forward pass. Images
+        large enough for tiled inference (or all of them, with `tiled=True`) are
+        run tile by tile instead, see predict_tiled.
+        """
+        images = list(images)
+        predictions = [None] * len(images)
+        for i, image in enumerate(images):
+            if should_tile(image) if tiled is None else tiled:
+                predictions[i] = self.predict_tiled(image)
+
+        whole = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if whole:
+            for i, prediction in zip(whole, self._predict_whole([images[i] for i in whole])):
+                predictions[i] = prediction
+        return predictions
+
+    def _predict_whole(self, images):
+        """One Prediction per image, each image letterboxed to the model input as a whole."""
+        outputs = [None] * len(images)
+        keys = [None] * len(images)
+        if self.cache:
+            for i, image in enumerate(images):
+                keys[i] = self.cache.key(image, self.weights_version)
+                boxes = self.cache.get(keys[i])
+                if boxes is not None:
+                    outputs[i] = self._results_from_boxes(image, boxes)
+
+        misses = [i for i, output in enumerate(outputs) if output is None]
+        if misses:
+            with metrics.span('model_forward'):
+                results = self._forward([images[i] for i in misses])
+            for i, result in zip(misses, results):
+                outputs[i] = result
+                if self.cache:
+                    self.cache.put(keys[i], result.boxes.data.cpu().numpy())
+
+        return [Prediction(self, image, [output]) for image, output in zip(images, outputs)]
+
+    def predict_tiled(self, image, tile_size = None, overlap = None, batch_size = None):
+        """Detect at native resolution by running overlapping tiles through the model, `batch_size` at a time.
+
+        Tiles are views into the decoded image and only one batch of them is in
+        the model at once, so the inference working set is bounded by the tile
+        size rather than the image size. Boxes are shifted back into image
+        coordinates and merged across tile borders; max_counts then apply as usual.
+        """
+        tile_size = tile_size or config.tiling['tile_size']
+        overlap = config.tiling['overlap'] if overlap is None else overlap
+        batch_size = batch_size or config.tiling['batch_size']
+        if isinstance(image, UploadedImage):
+            array = image.array
+        elif isinstance(image, np.ndarray):
+            array = image
+        else:
+            array = cv2.imread(str(image))
+            if array is None:
+                raise ValueError(f"Could not read {image}")
+        source = image if isinstance(image, UploadedImage) else array
+
+        key = None
+        if self.cache:
+            key = f'{self.cache.key(image, self.weights_version)}-tiled-{tile_size}-{overlap}'
+            boxes = self.cache.get(key)
+            if boxes is not None:
+                return Prediction(self, image, [self._results_from_boxes(source, boxes)])
+
+        windows = tile_windows(array.shape[1], array.shape[0], tile_size, overlap)
+        found = []
+        with metrics.span('model_forward'):
+            for start in range(0, len(windows), batch_size):
+                batch = windows[start:start + batch_size]
+                results = self._forward([array[y1:y2, x1:x2] for x1, y1, x2, y2 in batch])
+                for (x1, y1, _, _), result in zip(batch, results):
+                    boxes = result.boxes.data.cpu().numpy().astype(np.float32)
+                    boxes[:, [0, 2]] += x1
+                    boxes[:, [1, 3]] += y1
+                    found.append(boxes)
+                # Drop this batch's results (and their tile tensors) before the next one
+                del results
+
+        with metrics.span('tile_merge'):
+            boxes = merge_boxes(np.concatenate(found) if found else np.zeros((0, 6), dtype=np.float32))
+        if self.cache:
+            self.cache.put(key, boxes)
+        return Prediction(self, image, [self._results_from_boxes(source, boxes)])
+
+    def _forward(self, images):
+        """Run one batched forward pass and return the ultralytics Results in input order."""
+        with self._lock:
+            return self.model([self._model_input(image) for image in images], batch=len(images), verbose=False)
+
+    def _model_input(self, image):
+        """Decoded uploads are passed to ultralytics as arrays; paths are left for it to load."""
+        return image.array if isinstance(image, UploadedImage) else image
+
+    def _results_from_boxes(self, image, boxes):
+        """Rebuild an ultralytics Results object from cached (x1, y1, x2, y2, conf, cls) rows."""
+        import torch
+        from ultralytics.engine.results import Results
+
+        if isinstance(image, UploadedImage):
+            orig_img = image.array
+        elif isinstance(image, np.ndarray):
+            orig_img = image
+        else:
+            # ultralytics keeps original images in BGR order, as cv2 loads them
+            orig_img = cv2.imread(str(image))
+        return Results(orig_img, path=str(image), names=self.class_names, boxes=torch.from_numpy(boxes))
+
+
+def should_tile(image):
+    """Whether an image is large enough for tiled inference under config.tiling.
+
+    Uploads decide when they are decoded (see UploadedImage.tiled); paths are
+    only tiled when asked for explicitly.
+    """
+    if not config.tiling['enabled']:
+        return False
+    if isinstance(image, UploadedImage):
+        return image.tiled
+    if isinstance(image, np.ndarray):
+        return max(image.shape[:2]) >= config.tiling['min_side']
+    return False
+
+def tile_windows(width, height, tile_size, overlap):
+    """(x1, y1, x2, y2) windows of at most `tile_size` covering the image, neighbours overlapping by `overlap`."""
+    stride = max(1, round(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        # The last tile is shifted back to end on the border rather than running past it
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height)) for y in starts(height) for x in starts(width)]
+
+def merge_boxes(boxes, threshold = None):
+    """Merge (x1, y1, x2, y2, conf, cls) rows of the same part found in more than one tile.
+
+    Rows are taken from the most confident down. Any remaining row of the same
+    class covering more than `threshold` of the smaller box's area is folded
+    into the current one, which grows to the union of both, so a part cut by a
+    tile border is counted once. The result is sorted by confidence, like
+    ultralytics output, so max_counts keep the most confident detections.
+    """
+    threshold = config.tiling['merge_ios'] if threshold is None else threshold
+    boxes = boxes[np.argsort(-boxes[:, 4], kind='stable')]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    remaining = np.ones(len(boxes), dtype=bool)
+    merged = []
+    for i in range(len(boxes)):
+        if not remaining[i]:
+            continue
+        remaining[i] = False
+        box = boxes[i].copy()
+        while True:
+            candidates = np.flatnonzero(remaining & (boxes[:, 5] == box[5]))
+            if not len(candidates):
+                break
+            others = boxes[candidates]
+            width = np.clip(np.minimum(box[2], others[:, 2]) - np.maximum(box[0], others[:, 0]), 0, None)
+            height = np.clip(np.minimum(box[3], others[:, 3]) - np.maximum(box[1], others[:, 1]), 0, None)
+            smaller = np.minimum((box[2] - box[0]) * (box[3] - box[1]), areas[candidates])
+            absorbed = candidates[width * height > threshold * np.maximum(smaller, 1e-6)]
+            if not len(absorbed):
+                break
+            # The merged box may now reach further rows, so look again
+            remaining[absorbed] = False
+            box[:2] = np.minimum(box[:2], boxes[absorbed, :2].min(axis=0))
+            box[2:4] = np.maximum(box[2:4], boxes[absorbed, 2:4].max(axis=0))
+        merged.append(box)
+    return np.array(merged, dtype=np.float32).reshape(-1, 6)
+
+
+def max_counts_for(car_brand = None, car_model = None):
+    """Part caps for a vehicle: MAX_COUNTS with the brand's, then the model's overrides from config.detection."""
+    overrides = config.detection['max_counts']
+    return {**MAX_COUNTS, **overrides.get(car_brand, {}), **overrides.get(f'{car_brand}/{car_model}', {})}
+
+def top_k_per_class(boxes, caps):
+    """Keep the `caps[cls]` most confident (x1, y1, x2, y2, conf, cls) rows of each class.
+
+    `caps` is indexed by class id. Done with one sort and array ops rather than
+    a Python loop over boxes; the rows kept are returned most confident first.
+    """
+    if not len(boxes):
+        return boxes.reshape(0, 6)
+    classes = boxes[:, 5].astype(np.int64)
+    # Group by class, most confident first within each class
+    order = np.lexsort((-boxes[:, 4], classes))
+    classes = classes[order]
+    starts = np.flatnonzero(np.r_[True, classes[1:] != classes[:-1]])
+    ranks = np.arange(len(classes)) - np.repeat(starts, np.diff(np.r_[starts, len(classes)]))
+    kept = boxes[order[ranks < caps[classes]]]
+    return kept[np.argsort(-kept[:, 4], kind='stable')]
+
+
+class Prediction:
+    def __init__(self, model, image, output):
+        """Per-request state: the input image (path or decoded upload) and the raw YOLO output for it."""
+        self.model = model
+        self.class_names = model.class_names
+        self.max_counts = model.max_counts
+        self.image = image
+        self.output = output
+        self._kept = None
+
+    def set_max_counts(self, max_counts):
+        """Cap parts for a particular vehicle (see max_counts_for) instead of the model defaults."""
+        self.max_counts = max_counts
+        self._kept = None
+
+    def postprocess(self):
+        """Apply the part caps to the raw detections, keeping the most confident boxes of each part.
+
+        Counting, confidences and plotting all read this one result, so the
+        boxes drawn are exactly the ones billed.
+        """
+        boxes = self.output[0].boxes.data.cpu().numpy()  # Get the first (and only) result
+        caps = np.full(max(self.class_names) + 1, np.iinfo(np.int64).max, dtype=np.int64)
+        for cls, name in self.class_names.items():
+            if name in self.max_counts:
+                caps[cls] = self.max_counts[name]
+        self._kept = top_k_per_class(boxes, caps)
+        return self._kept
+
+    @property
+    def kept_boxes(self):
+        if self._kept is None:
+            self.postprocess()
+        return self._kept
 
     def get_detected_objects(self):
-        """Extract detected objects and their counts."""
-        results = self.output[0]  # Get the first (and only) result
-        detected_classes = [self.class_names[int(cls)] for cls in results.boxes.cls]
-        detected_counts = Counter(detected_classes)
-        
-        # Ensure detected counts do not exceed the maximum allowed counts
-        for part, max_count in self.max_counts.items():
-            if detected_counts[part] > max_count:
-                detected_counts[part] = max_count
-        
-        return detected_counts
+        """Counts of each detected part, within the part caps."""
+        counts = np.bincount(self.kept_boxes[:, 5].astype(np.int64), minlength=max(self.class_names) + 1)
+        return Counter({self.class_names[cls]: int(count) for cls, count in enumerate(counts) if count})
+
+    def get_confidences(self):
+        """Highest detection confidence of each part."""
+        confidences = {}
+        # Rows are most confident first, so the first row of each part is its best
+        for conf, cls in self.kept_boxes[:, 4:6].tolist():
+            confidences.setdefault(self.class_names[int(cls)], round(float(conf), 4))
+        return confidences
     
     def plot_image(self, save_path=None):
-        """Plot detections on the image, ensuring counts do not exceed max counts."""
-        # Load the original image
-        original_image = Image.open(self.image_path)
+        """Plot the detections kept by postprocess on the image.
 
-        # Plot detections on the image
+        Boxes are drawn straight onto the decoded image and each image is encoded
+        once. Returns the encoded original and annotated image bytes.
+        """
         results = self.output[0]  # Get the first (and only) result
+        filtered_boxes = self.kept_boxes
         
-        # Filter boxes to ensure they do not exceed max counts
-        filtered_boxes = []
-        counts = Counter()
-        for box in results.boxes:
-            class_name = self.class_names[int(box.cls)]
-            if counts[class_name] < self.max_counts.get(class_name, float('inf')):
-                filtered_boxes.append(box)
-                counts[class_name] += 1
+        # Reuse the decoded upload; ultralytics keeps the array it loaded for paths
+        array = self.image.array if isinstance(self.image, UploadedImage) else results.orig_img
         
-        results.boxes = filtered_boxes
-        
-        # Saving the output image if a `save_path` is provided and then opening that saved image. 
-        # If no `save_path` is provided, it simply displays the output image.
+        original_image_bytes = imaging.render_original(self.image if isinstance(self.image, UploadedImage) else array)
+        out_image_bytes = imaging.render(array, filtered_boxes, self.class_names)
         
+        # Saving the output image is optional and happens off the request thread
         if save_path:
-            out_image_path = results.save(save_path)
-            out_image = Image.open(out_image_path)
-        else:
-            out_image = results.show()
-        
-        # Convert images to byte arrays for web display with base64
-        original_image_bytes = self.image_to_bytes(original_image)
-        out_image_bytes = self.image_to_bytes(out_image)
-
-        return base64.b64encode(original_image_bytes).decode("utf-8"), base64.b64encode(out_image_bytes).decode("utf-8")
+            imaging.persist_async(out_image_bytes, save_path)
 
-    def image_to_bytes(self, image):
-        """Convert a PIL image to bytes. with base64 encoding."""
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        return buffered.getvalue()
+        return original_image_bytes, out_image_bytes
 
     def predict_price(self, car_brand = None, car_model = None):
         """Predict the price of the detected objects."""
-        # Get detected objects and their counts
-        
-        detected_counts = self.get_detected_objects()
-        
-        with self.db_connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM car_data WHERE brand = %s AND model = %s", (car_brand, car_model))
-            car_data = cursor.fetchall()
-            car_data = pd.DataFrame(car_data, columns=['id', 'brand', 'model', 'part', 'price'])
-            
-            # Calculate the price of each detected object
-            # also show the quantity of each object detected
-            estimated_prices = pd.DataFrame(columns=['Part', 'Quantity', 'Rate', 'Total'])
-            
-            rows = []
-            for part, count in detected_counts.items():
-                part_data = car_data[car_data['part'] == part]
-                if len(part_data) > 0:
-                    rate = part_data['price'].values[0]
-                    total = rate * count
-                else:
-                    rate = 0
-                    total = 0
-
-                rows.append({'Part': part, 'Quantity': count, 'Rate': rate, 'Total': total})
-                
-            estimated_prices = pd.concat([estimated_prices, pd.DataFrame(rows)], ignore_index=True)
-                    
-            # Convert the Total column to float
-            estimated_prices['Total'] = estimated_prices['Total'].astype(float)
-                
-            # Calculate the total price of all detected objects
-            total_price = estimated_prices['Total'].sum()
-            
-            # Show all the detected objects and their prices in a tabular format
-            cursor.close()
-         
-            return estimated_prices, total_price
+        return price_parts(self.get_detected_objects(), car_brand, car_model)
+
+
+class ClaimPrediction:
+    def __init__(self, predictions, max_counts = None):
+        """Several photos of the same car, estimated together as one claim.
+
+        `max_counts` (see max_counts_for) replaces the part caps of every photo.
+        """
+        self.predictions = list(predictions)
+        if max_counts is not None:
+            for prediction in self.predictions:
+                prediction.set_max_counts(max_counts)
+        self.max_counts = self.predictions[0].max_counts if self.predictions else dict(max_counts or {})
+
+    def get_detected_objects(self):
+        """Merge detected counts across views.
+
+        A part seen in several photos is most likely the same part, so each part
+        is billed for the largest count seen in any single view, capped by max_counts.
+        """
+        merged = Counter()
+        for prediction in self.predictions:
+            for part, count in prediction.get_detected_objects().items():
+                merged[part] = max(merged[part], count)
+
+        for part, max_count in self.max_counts.items():
+            if merged[part] > max_count:
+                merged[part] = max_count
+
+        return merged
+
+    def get_confidences(self):
+        """Highest confidence of each part in any photo of the claim."""
+        merged = {}
+        for prediction in self.predictions:
+            for part, conf in prediction.get_confidences().items():
+                merged[part] = max(merged.get(part, 0.0), conf)
+        return merged
+
+    def predict_price(self, car_brand = None, car_model = None):
+        """Predict the price of the parts detected across all photos of the claim."""
+        return price_parts(self.get_detected_objects(), car_brand, car_model)
+
+
+def price_parts(detected_counts, car_brand = None, car_model = None):
+    """Price a mapping of part -> count for the given car.
+
+    Returns one row per detected part (Part, Quantity, Rate, Total) and the total price.
+    """
+    with metrics.span('pricing'):
+        prices = price_catalog.get(car_brand, car_model) or {}
         
+        # Calculate the price of each detected object
+        # also show the quantity of each object detected
+        rows = []
+        total_price = 0.0
+        for part, count in detected_counts.items():
+            rate = prices.get(part, 0)
+            total = float(rate * count)
+            rows.append({'Part': part, 'Quantity': count, 'Rate': rate, 'Total': total})
+            total_price += total
     
-    def __del__(self):
-        """Close the database connection when the object is deleted."""
-        self.db_connection.close()
+    return rows, total_price
+
+
+# Process-wide model registry: weights are loaded and warmed once per worker
+_models = {}
+_models_lock = threading.Lock()
+
+def get_model(model_path = None):
+    """Return the shared YOLOModel for `model_path`, loading it on first use.
+
+    With config.worker_pool['processes'] set, inference runs in a pool of worker
+    processes instead of this one.
+    """
+    model_path = model_path or backends.resolve_weights()
+    model = _models.get(model_path)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_path)
+            if model is None:
+                if config.worker_pool['processes']:
+                    from workers import ProcessPoolYOLOModel
+                    model = ProcessPoolYOLOModel(model_path)
+                else:
+                    model = YOLOModel(model_path)
+                if config.yolo['warmup']:
+                    model.warmup()
+                _models[model_path] = model
+    return model
         
 
 # Example usage
 # if __name__ == "__main__":
-#     # Initialize the model
-#     img_path = "path-to-image.jpg"
-#     model = YOLOModel(image_path=img_path)
+#     # Get the shared model (loaded once per process)
+#     model = get_model()
     
 #     # Make predictions on the image
-#     model.predict()
+#     prediction = model.predict("path-to-image.jpg")
     
 #     # Get detected objects and their counts
-#     detected_objects = model.get_detected_objects()
+#     detected_objects = prediction.get_detected_objects()
 #     print("Detected Objects:", detected_objects)
     
 #     # Plot the detections on the image
-#     model.plot_image(save_path="output.png")
+#     prediction.plot_image(save_path="output.png")
     
 #     # Predict the price of the detected objects
-#     estimated_prices, total_price = model.predict_price(car_brand = "Toyota", car_model = "Corolla")
+#     estimated_prices, total_price = prediction.predict_price(car_brand = "Toyota", car_model = "Corolla")
 #     print("Detected Prices:")
 #     print(estimated_prices)
 #     print("Total Price:", total_price)
-    
-#     # Delete the model object to close the database connection
-
@@ -1,32 +1,88 @@
+import json
+import multiprocessing
 import os
-import pandas as pd
+import threading
+import time
 
+import catalog
+import db
+import estimate
 import forms
+import history
+import imaging
+import inference
+import jobs
 import logic
+import media
+import metrics
 import Model
+import pricing
+import tables
+import users
+import video
+import mysql.connector
 from flask_login import (LoginManager, UserMixin, current_user, login_required, login_user, logout_user)
-from flask_mysqldb import MySQL
 from werkzeug.security import check_password_hash, generate_password_hash
 
 import config
-from flask import (Flask, flash, redirect, render_template, request, url_for)
+from flask import (Flask, Response, abort, before_render_template, flash, g, jsonify, redirect, render_template, request, send_file, session, template_rendered, url_for)
 from datetime import datetime
+from urllib.parse import urlparse
 import base64
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+# Oversized uploads are refused with a 413 before the body is read
+app.config['MAX_CONTENT_LENGTH'] = config.uploads['max_request_bytes']
 
-app.config['MYSQL_USER'] = config.credentials['user']
-app.config['MYSQL_PASSWORD'] = config.credentials['password']
-app.config['MYSQL_HOST'] = config.credentials['host']
-app.config['MYSQL_PORT'] = int(config.credentials['port'])
-app.config['MYSQL_DB'] = config.credentials['database']
-
-mysql = MySQL(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+def warm_up():
+    """Load the YOLO weights (importing torch) and the price catalog ahead of the first estimate."""
+    try:
+        Model.get_model()
+        catalog.price_catalog.vehicles()
+    except Exception as e:
+        # The first estimate retries, so a failed warm-up must not stop the worker
+        print(f"Warm-up failed: {e}")
+
+# Importing the app stays fast and needs no database: the heavy warm-up runs in
+# the background while the worker already serves requests. Estimates arriving
+# before it finishes wait for the model registry. Inference processes re-import
+# this module when they start; they load their own copy.
+if config.yolo['preload'] and multiprocessing.parent_process() is None:
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+# Every request is timed and traced, so slow ones can be logged with their stage breakdown
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_trace()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        seconds = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.registry.observe('car_damage_request_duration_seconds', seconds, 'Time to produce a response, by route.',
+                                 method=request.method, route=route, status=response.status_code)
+        metrics.finish_trace('request', f'{request.method} {route}', seconds, status=response.status_code)
+    return response
+
+def _template_started(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        metrics.observe_stage('template', time.perf_counter() - started)
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
 class User(UserMixin):
     def __init__(self, user_id, email, name, is_admin=False):
         self.id = user_id
@@ -40,17 +96,30 @@ class User(UserMixin):
     def get_id(self):
         return self.id
 
-@login_manager.user_loader
-def load_user(user_id):
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM user_data WHERE user_id = %s", (user_id,))
-    user = cur.fetchone()
-    cur.close()
+def _fetch_user(user_id):
+    user = db.fetchone("SELECT * FROM user_data WHERE user_id = %s", (user_id,))
     
     if user:
         return User(user[0], user[2], user[1], user[-2])
     return None
 
+def _remember_identity(user):
+    """Keep the non-sensitive identity fields in the signed session cookie."""
+    session['identity'] = {'id': user.id, 'email': user.email, 'name': user.name, 'is_admin': bool(user.is_admin), 'checked': time.time()}
+
+@login_manager.user_loader
+def load_user(user_id):
+    if config.users['session_identity']:
+        identity = session.get('identity')
+        if identity and identity['id'] == user_id and time.time() - identity['checked'] < config.users['cache_ttl']:
+            users.cache.record_session_hit()
+            return User(identity['id'], identity['email'], identity['name'], identity['is_admin'])
+    
+    user = users.cache.get(user_id, _fetch_user)
+    if user and config.users['session_identity']:
+        _remember_identity(user)
+    return user
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     return render_template('index.html')
@@ -94,10 +163,7 @@ def register():
             car_brand = form.car_brand.data
             car_model = form.car_model.data
             
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM user_data WHERE email = %s", (email,))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM user_data WHERE email = %s", (email,))
             
             if user is not None:
                 print(user)
@@ -123,15 +189,14 @@ def login():
             password = form.password.data
             remember_me = form.remember.data
             
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM user_data WHERE email = %s", (email,))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM user_data WHERE email = %s", (email,))
             
             if user and check_password_hash(user[3], password):
                 user_obj = User(user[0], user[2], user[1], user[-2])
                 
                 if login_user(user_obj, remember=remember_me):
+                    if config.users['session_identity']:
+                        _remember_identity(user_obj)
                     if user[-2]:
                         return redirect(url_for('admin_dashboard'))
                     return redirect(url_for('dashboard'))
@@ -154,74 +219,118 @@ def admin_dashboard():
 @login_required
 def dashboard():
     # flash(f'Welcome, {current_user.name}!')
-    return render_template('dashboard.html')
+    recent_estimates = []
+    if config.history['enabled']:
+        try:
+            recent_estimates, _ = history.page(current_user.id, limit=5)
+        except Exception as e:
+            print(f"Could not load recent estimates: {e}")
+    return render_template('dashboard.html', recent_estimates=recent_estimates)
+
+@app.route('/history', methods=['GET'])
+@login_required
+def estimate_history():
+    """The user's stored estimates, newest first, a page at a time."""
+    before = request.args.get('before', type=int)
+    estimates, next_before = history.page(current_user.id, before=before)
+    return render_template('history.html', estimates=estimates, next_before=next_before, before=before)
 
-@app.route('/predict', methods=['GET', 'POST'])
+@app.route('/history/<int:estimate_id>', methods=['GET'])
 @login_required
-def predict():
+def estimate_history_detail(estimate_id):
+    """Show a stored estimate from its saved results; nothing is run again."""
+    stored = history.get(current_user.id, estimate_id)
+    if stored is None:
+        abort(404)
+    return render_template('result.html', **stored)
+
+def _estimate_form():
+    """Build the estimate form with brand choices and the models of the submitted brand."""
     form = forms.EstimateForm()
-    brandlist, modellist = logic.get_car_data()
+    models_by_brand = catalog.price_catalog.models_by_brand()
     
     # Always set car_brand choices regardless of method (GET or POST)
-    form.car_brand.choices = [(brand, brand) for brand in brandlist]
+    form.car_brand.choices = [(brand, brand) for brand in models_by_brand]
+
+    selected_brand = form.car_brand.data
+    if selected_brand in models_by_brand:
+        form.car_model.choices = [(model, model) for model in models_by_brand[selected_brand]]
+    
+    return form
+
+def _read_estimate_upload(form):
+    """Check a submitted estimate and decode its photos. Raises ValueError with a message for the user.
+
+    Returns the car brand and model, the estimate function to run and its input:
+    the decoded photos, or the path of a saved walk-around video.
+    """
+    car_brand = form.car_brand.data
+    car_model = form.car_model.data
+    upload_images = [upload_image for upload_image in form.upload_image.data or [] if upload_image.filename]
+    upload_video = form.upload_video.data if form.upload_video.data and form.upload_video.data.filename else None
+
+    if upload_video and upload_images:
+        raise ValueError('Please upload either photos or a video, not both.')
+
+    if len(upload_images) > config.claims['max_photos']:
+        raise ValueError(f"Please upload at most {config.claims['max_photos']} photos per claim.")
+
+    if not catalog.price_catalog.get(car_brand, car_model):
+        raise ValueError('Car brand or model not found. Please try again.')
+    
+    # Videos are sampled later, by the estimate itself
+    if upload_video:
+        return car_brand, car_model, video.run_video_estimate, video.save_upload(upload_video)
+
+    # Decode each upload once, straight from the request stream
+    try:
+        images = [imaging.UploadedImage(upload_image.read(), upload_image.filename) for upload_image in upload_images]
+    except ValueError as e:
+        raise ValueError(f'{e}. Please upload a valid JPG or PNG image.')
+    
+    return car_brand, car_model, estimate.run_estimate, images
+
+@app.errorhandler(413)
+def request_too_large(error):
+    limit = config.uploads['max_request_bytes'] // (1024 * 1024)
+    if request.path.startswith('/predict/jobs'):
+        return jsonify({'error': f"Uploads are limited to {limit} MB per estimate."}), 413
+    if request.path == url_for('predict'):
+        flash(f"Uploads are limited to {limit} MB per estimate.")
+        return redirect(url_for('predict'))
+    
+    flash(f"The upload is too large; requests are limited to {limit} MB.")
+    # Back to the form the upload came from; only same-site referrers are followed
+    referrer = urlparse(request.referrer or '')
+    if referrer.netloc == request.host and referrer.scheme in ('http', 'https'):
+        return redirect(request.referrer)
+    if request.path == url_for('admin_import_prices'):
+        return redirect(url_for('admin_add_update_car'))
+    return redirect(url_for('index'))
+
+def _file_prefix(car_brand, car_model):
+    current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # Get the current time
+    return f'{current_user.id}_{car_brand}_{car_model}_{current_time}'
+
+@app.route('/predict', methods=['GET', 'POST'])
+@login_required
+def predict():
+    form = _estimate_form()
 
     if request.method == 'POST':
-        # Handling brand selection and model population
-        if 'submit_car_brand' in request.form:
-            selected_brand = form.car_brand.data
-            if selected_brand in modellist:
-                models_brand = set(modellist[selected_brand])
-                form.car_model.choices = [(model, model) for model in models_brand]
-
-        selected_brand = form.car_brand.data
-        if selected_brand in modellist:
-            models_brand = set(modellist[selected_brand])
-            form.car_model.choices = [(model, model) for model in models_brand]
-        
         print(f"Available car model choices: {form.car_model.choices}")
         print(f"Selected car model: {form.car_model.data}")
         print(f"Selected car brand: {form.car_brand.data}")
         
         if 'submit' in request.form and form.validate_on_submit():
-            car_brand = form.car_brand.data
-            car_model = form.car_model.data
-            upload_image = form.upload_image.data
-
-            # Ensure the upload directory exists
-            upload_dir = os.path.join(app.root_path, 'static', 'uploads')
-            output_dir = os.path.join(app.root_path, 'static', 'outputs')
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)  # Create the directory if it doesn't exist
-
-            current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # Get the current time
-            
-            # Save the uploaded image
-            if upload_image:
-                image_path = f'{upload_dir}{current_user.id}_{car_brand}_{car_model}_{current_time}.jpg'
-                upload_image.save(image_path)
-            
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM car_data WHERE brand = %s AND model = %s", (car_brand, car_model))
-            car_data = cur.fetchall()
-            cur.close()
-            
-            if not car_data:
-                flash('Car brand or model not found. Please try again.')
+            try:
+                car_brand, car_model, run_estimate, source = _read_estimate_upload(form)
+                result = run_estimate(source, car_brand, car_model, file_prefix=_file_prefix(car_brand, car_model), user_id=current_user.id)
+            except ValueError as e:
+                flash(str(e))
                 return redirect(url_for('predict'))
             
-            path = image_path if upload_image else None
-            
-            model = Model.YOLOModel(image_path=path)
-            
-            model.predict()
-            
-            detected_objects = model.get_detected_objects()
-            estimated_prices, total_price = model.predict_price(car_brand, car_model)
-            
-            original_img , out_img = model.plot_image(save_path=f'{output_dir}{current_user.id}_{car_brand}_{car_model}_{current_time}_output.jpg')
-            
-            
-            return render_template('result.html', detected_objects=detected_objects, estimated_prices=estimated_prices, total_price=total_price, original_img=original_img, out_img=out_img)
+            return render_template('result.html', **result)
         
         else:
             print(f"Validation errors: {form.errors}")  
@@ -229,6 +338,139 @@ def predict():
     return render_template('predict.html', form=form)
 
 
+def _job_payload(job):
+    payload = job.to_dict()
+    payload['status_url'] = url_for('estimate_job_status', job_id=job.id)
+    payload['events_url'] = url_for('estimate_job_events', job_id=job.id)
+    payload['result_url'] = url_for('estimate_job_result', job_id=job.id)
+    return payload
+
+def _own_job(job_id):
+    job = jobs.queue.get(job_id)
+    if job is None or job.owner != current_user.id:
+        abort(404)
+    return job
+
+@app.route('/predict/jobs', methods=['POST'])
+@login_required
+def submit_estimate_job():
+    """Queue an estimate and return its job ID at once; progress is read by polling or server-sent events."""
+    form = _estimate_form()
+    if not form.validate_on_submit():
+        return jsonify({'error': 'Please check the form and try again.', 'fields': form.errors}), 400
+    
+    try:
+        car_brand, car_model, run_estimate, source = _read_estimate_upload(form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # A saved video is removed however the job ends, even if it never starts
+    cleanup = (lambda: video.discard(source)) if run_estimate is video.run_video_estimate else None
+    try:
+        job = jobs.queue.submit(current_user.id, run_estimate, source, car_brand, car_model, cleanup=cleanup,
+                                file_prefix=_file_prefix(car_brand, car_model), user_id=current_user.id)
+    except jobs.QueueFull:
+        return jsonify({'error': 'Too many estimates are in progress. Please try again shortly.'}), 503
+    
+    return jsonify(_job_payload(job)), 202
+
+@app.route('/predict/jobs/<job_id>', methods=['GET'])
+@login_required
+def estimate_job_status(job_id):
+    return jsonify(_job_payload(_own_job(job_id)))
+
+@app.route('/predict/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def estimate_job_events(job_id):
+    """Stream job progress as server-sent events until the job finishes."""
+    job = _own_job(job_id)
+    
+    def stream():
+        version = None
+        while True:
+            # Wake up on every change, or every 15s to keep the connection alive
+            version = jobs.queue.wait(job, version, timeout=15)
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.status in jobs.FINISHED:
+                break
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/predict/jobs/<job_id>/result', methods=['GET'])
+@login_required
+def estimate_job_result(job_id):
+    job = _own_job(job_id)
+    if job.status != 'done':
+        flash(job.error or 'The estimate is not ready yet.')
+        return redirect(url_for('predict'))
+    
+    return render_template('result.html', **job.result)
+
+
+@app.route('/api/car-models', methods=['GET'])
+@login_required
+def car_models():
+    """Brand -> models for the estimate form. Browsers revalidate with the ETag and get a 304 until the catalog changes."""
+    body, etag = catalog.price_catalog.models_by_brand_json()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/what-if', methods=['GET'])
+@login_required
+def what_if():
+    """Price a set of damaged parts (e.g. ?Door=2&Bumper=1) on every car in the catalog."""
+    limit = request.args.get('limit', str(config.what_if['default_limit']))
+    if not (limit.isascii() and limit.isdigit()) or not 1 <= int(limit) <= config.what_if['max_limit']:
+        return jsonify({'error': f"limit must be a whole number from 1 to {config.what_if['max_limit']}"}), 400
+    limit = int(limit)
+    descending = request.args.get('order') == 'desc'
+    detected_counts = {}
+    for part, value in request.args.items():
+        if part in ('limit', 'order'):
+            continue
+        if part not in catalog.PARTS:
+            return jsonify({'error': f"Unknown part '{part}'", 'parts': list(catalog.PARTS)}), 400
+        if not (value.isascii() and value.isdigit()):
+            return jsonify({'error': f"The count of {part} must be a whole number of 0 or more"}), 400
+        detected_counts[part] = int(value)
+    
+    return jsonify(pricing.pricing_engine.rank(detected_counts, limit=limit, descending=descending))
+
+
+@app.route('/media/<name>', methods=['GET'])
+def media_file(name):
+    """Serve a result image by its content hash. The bytes behind a name never change, so it is cached for good."""
+    if not media.is_valid_name(name):
+        abort(404)
+    
+    data = media.store.get(name)
+    if data is not None:
+        response = Response(data, mimetype=media.mimetype(name))
+        response.set_etag(name.split('.')[0])
+        response = response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    elif os.path.exists(media.store.path(name)):
+        response = send_file(media.store.path(name), mimetype=media.mimetype(name), etag=name.split('.')[0], conditional=True,
+                             max_age=config.media['max_age'])
+    else:
+        # Pruned to stay within the disk budget (see config.media); old history entries may still refer to it
+        response = Response(media.placeholder(), status=404, mimetype=media.MIME_TYPES['jpeg'])
+        response.cache_control.no_store = True
+        return response
+    
+    # Both branches answer range requests; say so on full responses as well
+    response.accept_ranges = 'bytes'
+    # send_file marks responses no-cache, which would make clients revalidate every time
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = config.media['max_age']
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/result', methods=['GET']) 
 @login_required
 def result():
@@ -238,10 +480,10 @@ def result():
 @app.route('/profile', methods=['GET'])
 @login_required
 def profile():
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM user_data WHERE user_id = %s", (current_user.id,))
-    user = cur.fetchone()
-    cur.close()
+    # pandas is only needed by these pages, so it is not imported at startup
+    import pandas as pd
+
+    user = db.fetchone("SELECT * FROM user_data WHERE user_id = %s", (current_user.id,))
     
     if not user:
         flash('User not found. Please login again.')
@@ -296,26 +538,22 @@ def update_account():
                 picture.save(f'{directory}{current_user.id}.jpg')
                 picture_path = f'{directory}{current_user.id}.jpg'
                 
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM users WHERE user_id = %s", (current_user.id,))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM users WHERE user_id = %s", (current_user.id,))
             
             if not user:
                 flash('User not found. Please login again.')
                 return redirect(url_for('login'))
             
             if email != user['email']:
-                cur = mysql.connection.cursor()
-                cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-                user2 = cur.fetchone()
-                cur.close()
+                user2 = db.fetchone("SELECT * FROM users WHERE email = %s", (email,))
                 
                 if user2:
                     flash('Email already exists. Please use a different email.')
                     return redirect(url_for('settings'))
             
             logic.update_user(user_id=current_user.id, name=name, email=email, phone=phone, address=address, city=city, state=state, zipcode=zip_code, country=country, car_brand=car_brand, car_model=car_model, picture=picture_path)
+            # The name or email in the session identity may have changed
+            session.pop('identity', None)
             flash('Account updated successfully.')
         
         return redirect(url_for('dashboard'))
@@ -331,10 +569,7 @@ def change_password():
             old_password = form.old_password.data
             new_password = form.new_password.data
             
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM users WHERE user_id = %s", (current_user.id,))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM users WHERE user_id = %s", (current_user.id,))
             
             if not user:
                 flash('User not found. Please login again.')
@@ -360,10 +595,7 @@ def reset_password():
         if form.validate_on_submit():
             email = form.email.data
         
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM users WHERE user_id = %s AND email = %s", (current_user.id, email))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM users WHERE user_id = %s AND email = %s", (current_user.id, email))
             
             if not user:
                 flash('User not found. Please login again.')
@@ -395,10 +627,7 @@ def delete_account():
             email = form.email.data
             password = form.password.data
             
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM users WHERE user_id = %s AND email = %s", (current_user.id, email))
-            user = cur.fetchone()
-            cur.close()
+            user = db.fetchone("SELECT * FROM users WHERE user_id = %s AND email = %s", (current_user.id, email))
             
             if not user:
                 flash('User not found. Please login again.')
@@ -408,6 +637,7 @@ def delete_account():
                 flash('Incorrect password. Please try again.')
                 
             logic.delete_user(user_id=current_user.id)
+            session.pop('identity', None)
             flash('Account deleted successfully.')
         
         return redirect(url_for('index'))
@@ -433,16 +663,105 @@ def admin_add_update_car():
             car_brand = car_brand.upper()
             car_model = car_model.capitalize()
 
-            cur = mysql.connection.cursor()
-            cur.execute("INSERT INTO car_data (brand, model, part, price) VALUES (%s, %s, %s, %s) ON DUPLICATE VALUES UPDATE price = %s",
-                        (car_brand, car_model, car_part, car_part_price, car_part_price))
-            mysql.connection.commit()
-            cur.close()
+            db.execute(catalog.UPSERT_PRICE, (car_brand, car_model, car_part, car_part_price))
+            
+            # Prices changed, so the next estimate must reload the catalog
+            catalog.price_catalog.invalidate()
             
             flash('Car data added/updated successfully.')
             return redirect(url_for('admin_dashboard'))
 
-    return render_template('admin_add_update_car.html', form = form)
+    return render_template('admin_add_update_car.html', form = form, import_form = forms.PriceImportForm())
+
+@app.route('/admin/import-prices', methods=['POST'])
+@login_required
+def admin_import_prices():
+    """Upsert a whole CSV price list (brand, model, part, price) in one transaction."""
+    if not current_user.is_admin:
+        flash('Access denied. Admins only.')
+        return redirect(url_for('index'))
+    
+    form = forms.PriceImportForm()
+    if not form.validate_on_submit():
+        flash('Please upload a CSV file.')
+        return redirect(url_for('admin_add_update_car'))
+    
+    try:
+        text = form.price_list.data.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        flash('The price list must be a UTF-8 encoded CSV file.')
+        return redirect(url_for('admin_add_update_car'))
+    
+    rows, errors = catalog.read_price_csv(text)
+    if errors:
+        # Nothing is imported unless every row is valid
+        flash(f"Price list not imported, {len(errors)} invalid row(s): {'; '.join(errors[:5])}")
+        return redirect(url_for('admin_add_update_car'))
+    
+    try:
+        report = catalog.import_prices(rows)
+    except mysql.connector.Error as e:
+        # The import runs in one transaction, so nothing was written
+        print(f"Error importing price list: {e}")
+        flash(f"Price list not imported: the database rejected it ({e.msg}).")
+        return redirect(url_for('admin_add_update_car'))
+    catalog.price_catalog.invalidate()
+    
+    flash(f"Imported {report['rows']} price(s): {report['inserted']} inserted, {report['updated']} updated, {report['unchanged']} unchanged.")
+    return redirect(url_for('admin_add_update_car'))
+
+@app.route('/admin/stats', methods=['GET'])
+@login_required
+def admin_stats():
+    if not current_user.is_admin:
+        flash('Access denied. Admins only.')
+        return redirect(url_for('index'))
+    
+    model = Model.get_model()
+    return jsonify({
+        'inference': inference.get_scheduler().stats(),
+        'catalog': catalog.price_catalog.stats(),
+        'db_pool': db.pool.stats(),
+        'media': media.store.stats(),
+        'jobs': jobs.queue.stats(),
+        'users': users.cache.stats(),
+        'history': history.writer.stats(),
+        'inference_cache': model.cache.stats() if model.cache else None,
+        'worker_pool': model.stats() if hasattr(model, 'stats') else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    token = config.metrics['token']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+
+    lines = metrics.registry.prometheus()
+    pool_stats = db.pool.stats()
+    lines += metrics.sample('car_damage_db_connections_in_use', 'gauge', 'Database connections checked out of the pool.', pool_stats['in_use'])
+    lines += metrics.sample('car_damage_db_checkout_timeouts_total', 'counter', 'Requests that timed out waiting for a database connection.', pool_stats['timeouts'])
+    job_stats = jobs.queue.stats()
+    lines += metrics.sample('car_damage_jobs_pending', 'gauge', 'Estimate jobs queued or running.', job_stats['pending'])
+    lines += metrics.sample('car_damage_jobs_rejected_total', 'counter', 'Estimate jobs refused because the queue was full.', job_stats['rejected'])
+    catalog_stats = catalog.price_catalog.stats()
+    lines += metrics.sample('car_damage_catalog_reloads_total', 'counter', 'Reloads of the price catalog from the database.', catalog_stats['reloads'])
+    user_stats = users.cache.stats()
+    lines += metrics.sample('car_damage_user_cache_hits_total', 'counter', 'Logged-in users served from the cache or the session.', user_stats['hits'] + user_stats['session_hits'])
+    lines += metrics.sample('car_damage_user_cache_misses_total', 'counter', 'Logged-in users read from the database.', user_stats['misses'])
+    media_stats = media.store.stats()
+    lines += metrics.sample('car_damage_media_memory_bytes', 'gauge', 'Result image bytes held in memory.', media_stats['memory_bytes'])
+    lines += metrics.sample('car_damage_media_disk_bytes', 'gauge', 'Result image bytes stored on disk.', media_stats['disk_bytes'])
+    # Scraping must not load the model, so the queue is only reported once inference has started
+    scheduler = inference.get_scheduler(start=False)
+    if scheduler is not None:
+        lines += metrics.sample('car_damage_inference_queue_depth', 'gauge', 'Images waiting to be batched for inference.', scheduler.stats()['queue_depth'])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def _table_page(name):
+    """Filter, sort and page an admin table from the query string. Raises ValueError for bad arguments."""
+    query = tables.TableQuery(name, request.args)
+    rows, next_cursor = query.page()
+    return {'rows': rows, 'query': query, 'next_cursor': next_cursor, 'table': name}
 
 @app.route('/admin/view-users', methods=['GET'])
 @login_required
@@ -451,14 +770,13 @@ def admin_view_users():
         flash('Access denied. Admins only.')
         return redirect(url_for('index'))
     
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM user_data")
-    users = cur.fetchall()
-    cur.close()
-    
-    users = pd.DataFrame(users, columns= "user_id name email password phone_number address city state zipcode country registration_date car_brand car_model is_admin profile_pic".split())
+    try:
+        page = _table_page('users')
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('admin_view_users'))
 
-    return render_template('admin_view_users.html', users=users)
+    return render_template('admin_view_users.html', users=page['rows'], **page)
 
 @app.route('/admin/view-car-data', methods=['GET'])
 @login_required
@@ -467,14 +785,13 @@ def admin_view_car_data():
         flash('Access denied. Admins only.')
         return redirect(url_for('index'))
     
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM car_data")
-    car_data = cur.fetchall()
-    cur.close()
+    try:
+        page = _table_page('car_data')
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('admin_view_car_data'))
     
-    car_data = pd.DataFrame(car_data, columns="id brand model part price".split())
-    
-    return render_template('admin_view_car_data.html', car_data=car_data)
+    return render_template('admin_view_car_data.html', car_data=page['rows'], **page)
 
 @app.route('/admin/view-messages', methods=['GET'])
 @login_required
@@ -483,19 +800,37 @@ def admin_view_messages():
         flash('Access denied. Admins only.')
         return redirect(url_for('index'))
     
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM message")
-    messages = cur.fetchall()
-    cur.close()
+    try:
+        page = _table_page('messages')
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('admin_view_messages'))
+    
+    return render_template('admin_view_messages.html', messages=page['rows'], **page)
+
+@app.route('/admin/export/<any(users, car_data, messages):table>.<any(csv, ndjson):export_format>', methods=['GET'])
+@login_required
+def admin_export(table, export_format):
+    """Stream a whole admin table, with the same filters and sort as the view, as CSV or NDJSON."""
+    if not current_user.is_admin:
+        abort(403)
     
-    messages = pd.DataFrame(messages, columns="id name email subject message date".split())
+    try:
+        query = tables.TableQuery(table, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query.after = None
     
-    return render_template('admin_view_messages.html', messages=messages)
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(query.stream(export_format), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{export_format}'
+    return response
 
 @app.route('/logout')
 @login_required
 def logout():
     logout_user()
+    session.pop('identity', None)
     flash('You have been logged out.')
     return redirect(url_for('index'))
 
@@ -0,0 +1,216 @@
+"""Inference backends for the YOLO weights.
+
+`best.pt` can be exported to ONNX Runtime or OpenVINO, optionally quantized
+to INT8 with a calibration set, and checked against the PyTorch baseline:
+
+    python backends.py export --backend openvino --int8 --calibration calib/ --verify val/
+
+ultralytics loads every exported format behind the same `YOLO(...)` API, so
+YOLOModel and the Prediction methods work unchanged whichever backend
+config.yolo['backend'] selects.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+import cv2
+import numpy as np
+
+import config
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def resolve_weights(weights = None, backend = None, int8 = None):
+    """Path of the model artifact for a backend, derived from the .pt weights path."""
+    weights = weights or config.yolo['weights']
+    backend = backend or config.yolo['backend']
+    int8 = config.yolo['int8'] if int8 is None else int8
+    stem = os.path.splitext(weights)[0]
+    if backend == 'pytorch':
+        return weights
+    if backend == 'onnx':
+        return f'{stem}.int8.onnx' if int8 else f'{stem}.onnx'
+    if backend == 'openvino':
+        # The directory names ultralytics gives its OpenVINO exports
+        return f'{stem}_int8_openvino_model' if int8 else f'{stem}_openvino_model'
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+def weights_version(path):
+    """Digest of a weights file, or of every file in an exported model directory."""
+    digest = hashlib.sha256()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    for file_path in paths:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def list_images(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _letterbox(image, size):
+    """Resize keeping the aspect ratio and pad to a square, as ultralytics does before inference."""
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+def _calibration_reader(images, input_name, imgsz):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(images)
+
+        def get_next(self):
+            path = next(self._paths, None)
+            if path is None:
+                return None
+            image = _letterbox(cv2.imread(path), imgsz)
+            # BGR HWC uint8 -> RGB NCHW float in [0, 1]
+            tensor = image[..., ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+            return {input_name: np.ascontiguousarray(tensor)}
+
+    return Reader()
+
+
+def export_onnx(weights, int8 = False, calibration = None, imgsz = 640):
+    from ultralytics import YOLO
+
+    path = YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if not int8:
+        return path
+
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    images = list_images(calibration)
+    if not images:
+        raise ValueError(f"INT8 quantization needs calibration images in {calibration}")
+
+    fp32 = onnx.load(path)
+    int8_path = resolve_weights(weights, 'onnx', int8=True)
+    quantize_static(path, int8_path, _calibration_reader(images, fp32.graph.input[0].name, imgsz),
+                    quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+
+    # Keep the class names and task ultralytics stores in the model metadata
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(fp32.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+def export_openvino(weights, int8 = False, calibration = None, imgsz = 640):
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    if not int8:
+        return model.export(format='openvino', imgsz=imgsz, dynamic=True)
+
+    if not list_images(calibration):
+        raise ValueError(f"INT8 quantization needs calibration images in {calibration}")
+
+    # ultralytics (NNCF) reads calibration images through a dataset yaml
+    workdir = tempfile.mkdtemp()
+    try:
+        data = os.path.join(workdir, 'calibration.yaml')
+        with open(data, 'w') as f:
+            json.dump({'path': os.path.abspath(calibration), 'train': '.', 'val': '.', 'names': model.names}, f)
+        return model.export(format='openvino', imgsz=imgsz, dynamic=True, int8=True, data=data)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def export(backend, weights = None, int8 = False, calibration = None, imgsz = 640):
+    """Convert the PyTorch weights into an optimized CPU format and return the artifact path."""
+    weights = weights or config.yolo['weights']
+    if backend == 'onnx':
+        return export_onnx(weights, int8, calibration, imgsz)
+    if backend == 'openvino':
+        return export_openvino(weights, int8, calibration, imgsz)
+    raise ValueError(f"Cannot export to '{backend}', expected onnx or openvino")
+
+
+def verify(candidate, images, reference = None, tolerance = 0.0):
+    """Compare an exported model with the PyTorch baseline.
+
+    Class names must match exactly; per-image detection counts per class must
+    agree on at least (1 - tolerance) of the images.
+    """
+    from ultralytics import YOLO
+
+    reference_model = YOLO(reference or config.yolo['weights'], task='detect')
+    candidate_model = YOLO(candidate, task='detect')
+
+    mismatches = []
+    for path in images:
+        expected = reference_model(path, verbose=False)[0]
+        actual = candidate_model(path, verbose=False)[0]
+        expected_counts = Counter(reference_model.names[int(cls)] for cls in expected.boxes.cls)
+        actual_counts = Counter(candidate_model.names[int(cls)] for cls in actual.boxes.cls)
+        if expected_counts != actual_counts:
+            mismatches.append({'image': path, 'reference': dict(expected_counts), 'candidate': dict(actual_counts)})
+
+    names_match = dict(reference_model.names) == dict(candidate_model.names)
+    agreement = 1 - len(mismatches) / len(images) if images else 1.0
+    return {
+        'candidate': candidate,
+        'names_match': names_match,
+        'images': len(images),
+        'count_agreement': round(agreement, 4),
+        'mismatches': mismatches,
+        'ok': names_match and agreement >= 1 - tolerance
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Export and verify CPU inference backends for the YOLO weights.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='export best.pt to an optimized CPU format')
+    export_parser.add_argument('--backend', choices=['onnx', 'openvino'], required=True)
+    export_parser.add_argument('--weights', default=config.yolo['weights'])
+    export_parser.add_argument('--int8', action='store_true', help='quantize to INT8 using --calibration images')
+    export_parser.add_argument('--calibration', help='directory of representative images for INT8 calibration')
+    export_parser.add_argument('--imgsz', type=int, default=640)
+    export_parser.add_argument('--verify', metavar='DIR', help='compare against the PyTorch baseline on these images')
+    export_parser.add_argument('--tolerance', type=float, default=None, help='allowed share of images whose counts differ (default 0, or 0.05 with --int8)')
+
+    verify_parser = subparsers.add_parser('verify', help='compare an exported model with the PyTorch baseline')
+    verify_parser.add_argument('candidate')
+    verify_parser.add_argument('images', metavar='DIR')
+    verify_parser.add_argument('--weights', default=config.yolo['weights'])
+    verify_parser.add_argument('--tolerance', type=float, default=0.0)
+
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        if args.int8 and not args.calibration:
+            parser.error('--int8 needs --calibration')
+        candidate = str(export(args.backend, args.weights, args.int8, args.calibration, args.imgsz))
+        print(f"Exported {args.backend}{' INT8' if args.int8 else ''} model to {candidate}")
+        if not args.verify:
+            return 0
+        tolerance = args.tolerance if args.tolerance is not None else (0.05 if args.int8 else 0.0)
+        report = verify(candidate, list_images(args.verify), args.weights, tolerance)
+    else:
+        report = verify(args.candidate, list_images(args.images), args.weights, args.tolerance)
+
+    print(json.dumps(report, indent=2))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""Offline micro-benchmarks for each stage of an estimate.
+
+Every stage runs against fixture photos, a stub (or the real local) model and
+an in-memory SQLite copy of car_database.sql, so no MySQL server is needed:
+
+    python benchmark.py --iterations 50 --output results.json
+    python benchmark.py --model real --images photos/ --compare results.json
+
+Per stage it reports latency percentiles, throughput and the memory allocated
+per call (from tracemalloc, in a separate pass so tracing does not skew the
+timings), plus how long a fresh interpreter takes to import app.py. Results
+are written as JSON; --compare prints the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+import config
+import imaging
+
+SQL_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'car_database.sql')
+FIXTURE_SIZES = ((640, 480), (1920, 1080), (4032, 3024))
+STAGES = ('decode', 'catalog_load', 'predict', 'get_detected_objects', 'predict_price', 'plot_image', 'render_result')
+
+
+class LocalDatabase:
+    def __init__(self, dump = SQL_DUMP):
+        """In-memory SQLite stand-in for MySQL holding the car_data rows of the SQL dump."""
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connection.execute("CREATE TABLE car_data (id INTEGER PRIMARY KEY, brand TEXT, model TEXT, part TEXT, price REAL)")
+        with open(dump, encoding='utf-8') as f:
+            for statement in re.findall(r'^INSERT INTO `car_data` VALUES .*;$', f.read(), re.MULTILINE):
+                # The extended MySQL INSERT is valid SQLite once the backticks are gone
+                self.connection.execute(statement.replace('`', ''))
+        self.connection.commit()
+
+    def fetchall(self, query, params = ()):
+        return self.connection.execute(query.replace('%s', '?'), params).fetchall()
+
+    def vehicles(self):
+        rows = self.fetchall("SELECT DISTINCT brand, model FROM car_data ORDER BY brand, model")
+        return [(brand, model) for brand, model in rows]
+
+
+def local_catalog(database):
+    """A PriceCatalog that loads from the SQLite stand-in instead of the MySQL pool."""
+    from catalog import PriceCatalog
+
+    class LocalPriceCatalog(PriceCatalog):
+        def _load(self):
+            index = {}
+            for brand, model, part, price in database.fetchall("SELECT brand, model, part, price FROM car_data ORDER BY id"):
+                index.setdefault((brand, model), {}).setdefault(part, float(price or 0))
+            return index
+
+    return LocalPriceCatalog(ttl=0)
+
+
+def stub_model(detections = 12, seed = 0):
+    """A YOLOModel that returns seeded random boxes instead of running a network."""
+    import Model
+
+    class StubYOLOModel(Model.YOLOModel):
+        def __init__(self):
+            self.model_path = 'stub'
+            self.class_names = dict(enumerate(Model.MAX_COUNTS))
+            self.max_counts = dict(Model.MAX_COUNTS)
+            self.weights_version = 'stub'
+            self.cache = None
+            self._rng = np.random.default_rng(seed)
+
+        def warmup(self, size = None):
+            pass
+
+        def _forward(self, images):
+            results = []
+            for image in images:
+                height, width = self._model_input(image).shape[:2]
+                corners = self._rng.uniform(0, 1, (detections, 4)) * [width, height, width, height]
+                boxes = np.column_stack([
+                    np.minimum(corners[:, 0], corners[:, 2]), np.minimum(corners[:, 1], corners[:, 3]),
+                    np.maximum(corners[:, 0], corners[:, 2]), np.maximum(corners[:, 1], corners[:, 3]),
+                    self._rng.uniform(0.25, 1.0, detections),
+                    self._rng.integers(0, len(self.class_names), detections)
+                ]).astype(np.float32)
+                results.append(self._results_from_boxes(image, boxes))
+            return results
+
+    return StubYOLOModel()
+
+
+def fixture_images(directory = None, sizes = FIXTURE_SIZES, seed = 0):
+    """Encoded fixture photos: JPEG/PNG files from `directory`, or synthetic JPEGs of phone-camera sizes."""
+    if directory:
+        from backends import list_images
+        fixtures = []
+        for path in list_images(directory):
+            with open(path, 'rb') as f:
+                fixtures.append((os.path.basename(path), f.read()))
+        return fixtures
+
+    rng = np.random.default_rng(seed)
+    fixtures = []
+    for width, height in sizes:
+        # Smooth gradients with some noise compress like a photo rather than like pure noise
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        channels = [np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2]
+        array = np.dstack(channels) + rng.normal(0, 12, (height, width, 3))
+        _, encoded = cv2.imencode('.jpg', np.clip(array, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        fixtures.append((f'fixture_{width}x{height}.jpg', encoded.tobytes()))
+    return fixtures
+
+
+def result_renderer():
+    """Render result.html outside the real app: unknown endpoints resolve to '#' and nobody is logged in."""
+    from flask import Flask, render_template
+    from flask_login import AnonymousUserMixin
+
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+    app.secret_key = 'benchmark'
+    app.url_build_error_handlers.append(lambda error, endpoint, values: '#')
+    app.context_processor(lambda: {'current_user': AnonymousUserMixin()})
+
+    def render(context):
+        with app.test_request_context():
+            return render_template('result.html', **context)
+
+    return render
+
+
+def measure(fn, iterations, warmup = 1):
+    """Time `fn` over `iterations` calls, then count what it allocates in a traced pass."""
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - call_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    traced = max(1, min(iterations, 5))
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(traced):
+            fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))]
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(0.50), 3),
+        'p90_ms': round(percentile(0.90), 3),
+        'p99_ms': round(percentile(0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'min_ms': round(latencies[0], 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_per_s': round(iterations / elapsed, 2) if elapsed else None,
+        'peak_alloc_bytes': peak - before,
+        'retained_bytes_per_call': (after - before) // traced
+    }
+
+
+def run(model, fixtures, database, iterations = 20, car = None):
+    """Benchmark every stage for each fixture image and return the report."""
+    import Model
+
+    catalog = local_catalog(database)
+    # price_parts looks the catalog up through Model's module global
+    Model.price_catalog = catalog
+    car_brand, car_model = car or database.vehicles()[0]
+    render = result_renderer()
+
+    report = {}
+    for name, data in fixtures:
+        image = imaging.UploadedImage(data, name)
+        prediction = model.predict(image)
+        detected_objects = prediction.get_detected_objects()
+        estimated_prices, total_price = prediction.predict_price(car_brand, car_model)
+        context = {
+            'car_brand': car_brand,
+            'car_model': car_model,
+            'detected_objects': dict(detected_objects),
+            'estimated_prices': estimated_prices,
+            'total_price': total_price,
+            'images': [('0' * 64 + '.jpg', '1' * 64 + '.jpg')]
+        }
+
+        stages = {
+            'decode': lambda: imaging.UploadedImage(data, name),
+            'catalog_load': lambda: (catalog.invalidate(), catalog.get(car_brand, car_model)),
+            'predict': lambda: model.predict(image),
+            'get_detected_objects': lambda: (prediction.postprocess(), prediction.get_detected_objects()),
+            'predict_price': lambda: prediction.predict_price(car_brand, car_model),
+            'plot_image': prediction.plot_image,
+            'render_result': lambda: render(context)
+        }
+        report[name] = {
+            'width': image.original_size[0],
+            'height': image.original_size[1],
+            'decoded_shape': list(image.array.shape),
+            'stages': {stage: measure(stages[stage], iterations) for stage in STAGES}
+        }
+    return report
+
+
+def measure_import(module = 'app', repeat = 3, top = 10):
+    """Time `import module` in fresh interpreters, without the background model warm-up.
+
+    Returns the best wall time and the slowest imports by cumulative time (from -X importtime).
+    """
+    env = dict(os.environ, MODEL_PRELOAD='0')
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    modules = {}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                   cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        for line in completed.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            parts = line.split('|')
+            if line.startswith('import time:') and parts[1].strip().isdigit():
+                name = parts[2].strip()
+                modules[name] = min(modules.get(name, float('inf')), int(parts[1]) / 1000)
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:top]
+    return {
+        'module': module,
+        'wall_ms': round(min(timings), 1),
+        'slowest_imports_ms': {name: round(ms, 1) for name, ms in slowest}
+    }
+
+
+def environment(model_name):
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'model': model_name,
+        'backend': config.yolo['backend'],
+        'rendering': dict(config.rendering),
+        'decode_target': config.uploads['decode_target']
+    }
+
+
+def compare(current, baseline):
+    """Print the p50 / p99 change of every stage present in both runs."""
+    if 'startup' in current and 'startup' in baseline:
+        print(f"import app  {baseline['startup']['wall_ms']:>9.1f} -> {current['startup']['wall_ms']:>9.1f} ms")
+    for image, entry in current['results'].items():
+        previous = baseline['results'].get(image)
+        if previous is None:
+            continue
+        print(image)
+        for stage, stats in entry['stages'].items():
+            old = previous['stages'].get(stage)
+            if not old:
+                continue
+            change = lambda key: (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"  {stage:<22} p50 {old['p50_ms']:>9.3f} -> {stats['p50_ms']:>9.3f} ms ({change('p50_ms'):+6.1f}%)"
+                  f"  p99 {old['p99_ms']:>9.3f} -> {stats['p99_ms']:>9.3f} ms ({change('p99_ms'):+6.1f}%)")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the estimate pipeline offline.')
+    parser.add_argument('--model', choices=['stub', 'real'], default='stub', help='stub boxes, or the configured YOLO weights')
+    parser.add_argument('--weights', help='weights for --model real (default: config.yolo)')
+    parser.add_argument('--images', metavar='DIR', help='fixture photos (default: synthetic JPEGs)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--skip-import', action='store_true', help='do not time importing app.py')
+    parser.add_argument('--car', nargs=2, metavar=('BRAND', 'MODEL'), help='vehicle to price (default: first in the dump)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', metavar='JSON', help='earlier report to compare against')
+    args = parser.parse_args(argv)
+
+    if args.model == 'real':
+        import Model
+        model = Model.YOLOModel(args.weights)
+        # Measure the forward pass, not the inference cache
+        model.cache = None
+        model.warmup()
+    else:
+        model = stub_model()
+
+    report = {
+        'environment': environment(args.model),
+        'results': run(model, fixture_images(args.images), LocalDatabase(), args.iterations, args.car)
+    }
+    if not args.skip_import:
+        report['startup'] = measure_import()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from imaging import UploadedImage
+
+
+def file_digest(path):
+    """Hash a file on disk in chunks, e.g. an upload or the model weights."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def image_digest(image):
+    """Hash an image given as a decoded upload, file path, raw bytes or array."""
+    if isinstance(image, UploadedImage):
+        return image.digest
+    if isinstance(image, (str, os.PathLike)):
+        return file_digest(image)
+    digest = hashlib.sha256()
+    if isinstance(image, np.ndarray):
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).tobytes())
+    else:
+        digest.update(image)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    def __init__(self, max_entries = None, directory = None, max_disk_bytes = None):
+        """Two-tier cache of raw detections (N x 6 box arrays): an in-memory LRU backed by .npy files on disk."""
+        self.max_entries = max_entries or config.inference_cache['max_entries']
+        self.directory = config.inference_cache['dir'] if directory is None else directory
+        self.max_disk_bytes = max_disk_bytes or config.inference_cache['max_disk_bytes']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk_bytes = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    def key(self, image, weights_version):
+        key = f'{weights_version[:16]}-{image_digest(image)}'
+        if isinstance(image, UploadedImage):
+            # Boxes are in the coordinates of the decoded array, whose size depends on the decode scale
+            height, width = image.array.shape[:2]
+            key += f'-{width}x{height}'
+        return key
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        """Return the cached box array for `key`, or None."""
+        with self._lock:
+            boxes = self._entries.get(key)
+            if boxes is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return boxes
+
+        if self.directory and os.path.exists(self._path(key)):
+            try:
+                boxes = np.load(self._path(key))
+            except (OSError, ValueError) as e:
+                print(f"Inference cache read error: {e}")
+            else:
+                self._remember(key, boxes)
+                with self._lock:
+                    self.disk_hits += 1
+                return boxes
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, boxes):
+        boxes = np.asarray(boxes, dtype=np.float32)
+        self._remember(key, boxes)
+        if self.directory:
+            self._write(key, boxes)
+
+    def _remember(self, key, boxes):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = boxes
+            self.memory_bytes += boxes.nbytes
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.memory_bytes -= evicted.nbytes
+
+    def _write(self, key, boxes):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        # Write to a temporary name first so a crash never leaves a truncated entry
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, boxes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Inference cache write error: {e}")
+            return
+        with self._lock:
+            self.disk_bytes += os.path.getsize(path)
+            over_budget = self.disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._prune()
+
+    def _prune(self):
+        """Delete the least recently written files until the disk tier is back under 90% of its budget."""
+        entries = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self.disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'memory_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -29,7 +29,8 @@ CREATE TABLE `car_data` (
   `model` varchar(50) DEFAULT NULL,
   `part` varchar(50) DEFAULT NULL,
   `price` decimal(10,2) DEFAULT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_car_data_vehicle_part` (`brand`,`model`,`part`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1268 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -89,6 +90,22 @@ CREATE TABLE `user_data` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+-- Structure for `estimates` Table
+CREATE TABLE `estimates` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `user_id` varchar(10) NOT NULL,
+  `car_brand` varchar(50) NOT NULL,
+  `car_model` varchar(50) NOT NULL,
+  `detected_objects` json NOT NULL,
+  `confidences` json NOT NULL,
+  `estimated_prices` json NOT NULL,
+  `total_price` decimal(12,2) NOT NULL,
+  `images` json NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_estimates_user` (`user_id`, `id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
 -- Dumping data for table `user_data`
 
 LOCK TABLES `user_data` WRITE;
@@ -0,0 +1,173 @@
+import csv
+import hashlib
+import io
+import json
+import math
+import threading
+import time
+
+import config
+from db import get_db_connection
+
+PARTS = ('Bonnet', 'Bumper', 'Dickey', 'Door', 'Fender', 'Light', 'Windshield')
+# Largest value of the DECIMAL(10,2) price column
+MAX_PRICE = 99999999.99
+
+# Relies on the (brand, model, part) unique key, see migrations/001_car_data_unique_vehicle_part.sql
+UPSERT_PRICE = ("INSERT INTO car_data (brand, model, part, price) VALUES (%s, %s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE price = VALUES(price)")
+
+
+class PriceCatalog:
+    def __init__(self, ttl = None):
+        """In-memory index of the car_data table: (brand, model) -> {part: price}."""
+        # Other workers only see an admin edit after `ttl` seconds, so keep it short
+        self.ttl = config.catalog['ttl'] if ttl is None else ttl
+        self._index = None
+        self._models_by_brand = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _load(self):
+        """Read the whole price table once and build the lookup index."""
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT brand, model, part, price FROM car_data ORDER BY id")
+                rows = cursor.fetchall()
+
+        index = {}
+        for brand, model, part, price in rows:
+            # Keep the first price of a part, as the old per-request lookup did
+            index.setdefault((brand, model), {}).setdefault(part, float(price or 0))
+        return index
+
+    def _current(self):
+        """Return the index, reloading it if it was invalidated or has expired."""
+        index = self._index
+        if index is None or (self.ttl and time.monotonic() - self._loaded_at > self.ttl):
+            with self._lock:
+                # Another thread may have reloaded while we waited for the lock
+                if self._index is index:
+                    self._index = self._load()
+                    self._loaded_at = time.monotonic()
+                    self.version += 1
+                    self.reloads += 1
+                index = self._index
+        return index
+
+    def get(self, brand, model):
+        """Return the {part: price} mapping for a vehicle, or None if it is not in the catalog."""
+        prices = self._current().get((brand, model))
+        if prices is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return prices
+
+    def vehicles(self):
+        """Return the full index; callers must treat it as read-only."""
+        return self._current()
+
+    def _vehicle_models(self):
+        """(index, {brand: [models]}, JSON body, ETag), rebuilt only when the index is reloaded."""
+        index = self._current()
+        cached = self._models_by_brand
+        if cached is None or cached[0] is not index:
+            models = {}
+            for brand, model in sorted(vehicle for vehicle in index if all(vehicle)):
+                models.setdefault(brand, []).append(model)
+            body = json.dumps(models, separators=(',', ':')).encode()
+            # Derived from the content, so a reload that changes nothing keeps the same ETag
+            cached = self._models_by_brand = (index, models, body, hashlib.sha256(body).hexdigest()[:32])
+        return cached
+
+    def models_by_brand(self):
+        """Return {brand: [models]} in sorted order; callers must treat it as read-only."""
+        return self._vehicle_models()[1]
+
+    def models_by_brand_json(self):
+        """Return the brand -> models mapping as encoded JSON and its ETag."""
+        _, _, body, etag = self._vehicle_models()
+        return body, etag
+
+    def invalidate(self):
+        """Drop the index so the next lookup reloads it from the database."""
+        with self._lock:
+            self._index = None
+
+    def stats(self):
+        index = self._index
+        return {
+            'vehicles': len(index) if index is not None else 0,
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'ttl': self.ttl
+        }
+
+
+def read_price_csv(text):
+    """Parse a `brand,model,part,price` CSV price list. Returns the rows and a list of error messages.
+
+    Later rows for the same brand, model and part replace earlier ones.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+    missing = [name for name in ('brand', 'model', 'part', 'price') if name not in fields]
+    if missing:
+        return [], [f"Missing column(s): {', '.join(missing)}"]
+
+    parts = {part.lower(): part for part in PARTS}
+    rows = {}
+    errors = []
+    for line, record in enumerate(reader, start=2):
+        brand = (record[fields['brand']] or '').strip().upper()
+        model = (record[fields['model']] or '').strip()
+        part = parts.get((record[fields['part']] or '').strip().lower())
+        try:
+            price = round(float(record[fields['price']]), 2)
+        except (TypeError, ValueError):
+            price = None
+        if not brand or not model:
+            errors.append(f"Line {line}: brand and model are required")
+        elif part is None:
+            errors.append(f"Line {line}: unknown part '{record[fields['part']]}'")
+        elif price is None or not math.isfinite(price) or not 0 <= price <= MAX_PRICE:
+            errors.append(f"Line {line}: invalid price '{record[fields['price']]}'")
+        else:
+            rows[(brand.lower(), model.lower(), part)] = (brand, model, part, price)
+    return list(rows.values()), errors
+
+def import_prices(rows, batch_size = None):
+    """Upsert (brand, model, part, price) rows in batches, all in one transaction.
+
+    Returns how many rows were inserted, updated and already up to date.
+    """
+    batch_size = batch_size or config.catalog['import_batch_size']
+    with get_db_connection() as connection:
+        connection.start_transaction()
+        with connection.cursor(buffered=True) as cursor:
+            # Both counts read the transaction's own snapshot, so concurrent writers do not skew them
+            cursor.execute("SELECT COUNT(*) FROM car_data")
+            before = cursor.fetchone()[0]
+            affected = 0
+            for start in range(0, len(rows), batch_size):
+                # mysql.connector sends each batch as one multi-row INSERT
+                cursor.executemany(UPSERT_PRICE, rows[start:start + batch_size])
+                affected += cursor.rowcount
+            cursor.execute("SELECT COUNT(*) FROM car_data")
+            after = cursor.fetchone()[0]
+            connection.commit()
+
+    # MySQL counts 1 affected row per insert, 2 per changed update and 0 per unchanged row
+    inserted = after - before
+    updated = (affected - inserted) // 2
+    return {'rows': len(rows), 'inserted': inserted, 'updated': updated, 'unchanged': len(rows) - inserted - updated}
+
+
+price_catalog = PriceCatalog()
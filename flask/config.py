@@ -1,3 +1,5 @@
+import os
+
 credentials = {
     'user': 'user',
     'password': 'password',
@@ -5,3 +7,196 @@ credentials = {
     'port': 'port',
     'database': 'database'
 }
+
+# Shared MySQL connection pool (mysql.connector caps pool size at 32)
+db_pool = {
+    'size': int(os.environ.get('DB_POOL_SIZE', 8)),
+    'checkout_timeout': 5,
+    'health_check_interval': 30
+}
+
+# YOLO weights and warm-up settings. The weights path can be overridden per
+# deployment with the MODEL_PATH environment variable. `backend` picks the
+# runtime ('pytorch', 'onnx' or 'openvino'); the exported model is expected
+# next to best.pt, see `python backends.py export --help`. With `preload`
+# the weights are loaded and warmed in a background thread when the app starts,
+# otherwise on the first estimate.
+yolo = {
+    'weights': os.environ.get('MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model weights', 'weights', 'best.pt')),
+    'backend': os.environ.get('MODEL_BACKEND', 'pytorch'),
+    'int8': os.environ.get('MODEL_INT8', '0') == '1',
+    'warmup': True,
+    'warmup_size': 640,
+    'preload': os.environ.get('MODEL_PRELOAD', '1') == '1'
+}
+
+# Per-vehicle overrides of the part caps in Model.MAX_COUNTS (the most parts
+# of each kind a vehicle can have). Keys are a brand or 'brand/model', the
+# model's entry winning, e.g. {'Toyota/GR86': {'Door': 2}}. Beyond a cap the
+# least confident detections of that part are neither counted nor drawn.
+detection = {
+    'max_counts': {}
+}
+
+# Micro-batching of concurrent estimate requests: a batch is dispatched once it
+# holds `max_batch_size` images or the oldest request has waited `max_wait_ms`.
+inference = {
+    'max_batch_size': int(os.environ.get('INFERENCE_MAX_BATCH', 8)),
+    'max_wait_ms': float(os.environ.get('INFERENCE_MAX_WAIT_MS', 20))
+}
+
+# Tiled inference for very high-resolution photos (drone and inspection
+# cameras). With `enabled`, photos whose longest side is at least `min_side`
+# pixels are decoded at full resolution and run through the model as
+# overlapping `tile_size` tiles, `batch_size` tiles per forward pass, so small
+# parts are not lost to letterboxing. Detections of the same part overlapping
+# by more than `merge_ios` of the smaller box are merged across tile borders
+# before max_counts are applied.
+tiling = {
+    'enabled': os.environ.get('TILED_INFERENCE', '0') == '1',
+    'min_side': int(os.environ.get('TILE_MIN_SIDE', 5000)),
+    'tile_size': int(os.environ.get('TILE_SIZE', 1024)),
+    'overlap': 0.2,
+    'batch_size': 8,
+    'merge_ios': 0.5
+}
+
+# Multi-photo claims: all photos are run as one batch and priced together
+claims = {
+    'max_photos': 10
+}
+
+# Walk-around videos are decoded as a stream and sampled every `min_interval`
+# to `max_interval` seconds: the gap widens while sampled frames repeat and
+# narrows when the view changes. Frames within `dedup_distance` bits (of a
+# 64-bit difference hash) of a keyframe already taken are skipped. At most
+# `max_keyframes` frames from the first `max_duration` seconds, downscaled to
+# `frame_max_dim`, are run through the model as one claim.
+video = {
+    'min_interval': 0.5,
+    'max_interval': 4.0,
+    'dedup_distance': 10,
+    'max_keyframes': 12,
+    'max_duration': 180,
+    'frame_max_dim': 1280
+}
+
+# In-memory price catalog. Admin edits invalidate the local worker at once;
+# other workers pick them up when their copy is older than `ttl` seconds.
+# CSV price imports are upserted `import_batch_size` rows per statement.
+catalog = {
+    'ttl': 300,
+    'import_batch_size': 1000
+}
+
+# /api/what-if returns `default_limit` ranked vehicles unless asked for more,
+# and never more than `max_limit`.
+what_if = {
+    'default_limit': 20,
+    'max_limit': 500
+}
+
+# Logged-in users are cached for `cache_ttl` seconds instead of being read from
+# user_data on every request; account changes invalidate the local worker at
+# once, other workers within the ttl. With `session_identity` the user's id,
+# name, email and admin flag also travel in the signed session cookie and are
+# trusted for up to `cache_ttl` seconds before being checked again.
+users = {
+    'cache_ttl': 60,
+    'max_entries': 4096,
+    'session_identity': os.environ.get('SESSION_IDENTITY', '0') == '1'
+}
+
+# Cache of raw detections keyed on image hash + weights version. The disk tier
+# survives restarts; set 'dir' to None to keep the cache in memory only.
+inference_cache = {
+    'enabled': True,
+    'max_entries': 512,
+    'dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'inference'),
+    'max_disk_bytes': 256 * 1024 * 1024
+}
+
+# Uploads are decoded in memory; keeping a copy on disk is optional and done
+# in the background so it never adds to the response time. Requests larger
+# than 'max_request_bytes' are refused before the body is read; each photo's
+# header is checked against 'max_file_bytes' / 'max_pixels' before decoding,
+# and large JPEGs are decoded at a reduced scale whose longest side is still
+# at least 'decode_target' pixels (the inference resolution).
+uploads = {
+    'max_request_bytes': int(os.environ.get('MAX_REQUEST_MB', 64)) * 1024 * 1024,
+    'max_file_bytes': 20 * 1024 * 1024,
+    'max_pixels': 50_000_000,
+    'decode_target': int(os.environ.get('DECODE_TARGET', 640)),
+    'persist': os.environ.get('PERSIST_UPLOADS', '1') == '1',
+    'upload_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads'),
+    'output_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'outputs')
+}
+
+# Result images: output format ('jpeg' or 'webp'), encoder quality and the
+# longest side in pixels the images are downscaled to before encoding.
+rendering = {
+    'format': os.environ.get('RESULT_IMAGE_FORMAT', 'jpeg'),
+    'quality': 85,
+    'max_dim': 1280
+}
+
+# Result images are served from content-hash URLs with long-lived caching.
+# Recent images are kept in memory so they can be served before the
+# background write to `dir` has finished. Once the files in `dir` exceed
+# `max_disk_bytes`, the oldest are deleted; history entries that still refer
+# to them get a placeholder image with a 404.
+media = {
+    'dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'),
+    'max_memory_bytes': 64 * 1024 * 1024,
+    'max_disk_bytes': int(os.environ.get('MEDIA_MAX_DISK_MB', 2048)) * 1024 * 1024,
+    'max_age': 365 * 24 * 60 * 60
+}
+
+# Asynchronous estimate jobs: worker threads, how many jobs may wait before new
+# ones are rejected, the per-job timeout and how long finished jobs are kept.
+jobs = {
+    'workers': int(os.environ.get('ESTIMATE_WORKERS', 2)),
+    'max_pending': 32,
+    'timeout': 120,
+    'ttl': 15 * 60
+}
+
+# Multi-process CPU inference. With `processes` > 0 each worker process loads
+# its own copy of the weights and uses `threads` intra-op threads (0 splits the
+# cores evenly between the processes). Decoded images reach the workers
+# through shared memory.
+worker_pool = {
+    'processes': int(os.environ.get('INFERENCE_PROCESSES', 0)),
+    'threads': int(os.environ.get('INFERENCE_THREADS', 0)),
+    'startup_timeout': 300,
+    'task_timeout': 120
+}
+
+# Estimate history. Finished estimates are queued and written by a background
+# thread, up to `batch_size` rows per INSERT and at most `flush_interval`
+# seconds late; if more than `max_pending` are waiting, new ones are dropped.
+history = {
+    'enabled': os.environ.get('ESTIMATE_HISTORY', '1') == '1',
+    'batch_size': 50,
+    'flush_interval': 0.5,
+    'max_pending': 1000,
+    'page_size': 20
+}
+
+# Admin table views: rows per page (the `limit` argument is capped at
+# 'max_page_size') and rows fetched per round trip while streaming an export.
+admin = {
+    'page_size': 50,
+    'max_page_size': 500,
+    'export_batch_size': 1000
+}
+
+# Runtime metrics served in Prometheus text format on /metrics. With 'token'
+# set, scrapers must send `Authorization: Bearer <token>`. Requests and jobs
+# slower than 'slow_request_ms' (0 turns it off) are logged with their
+# per-stage breakdown to 'slow_request_log', or to stderr when it is unset.
+metrics = {
+    'token': os.environ.get('METRICS_TOKEN'),
+    'slow_request_ms': int(os.environ.get('SLOW_REQUEST_MS', 0)),
+    'slow_request_log': os.environ.get('SLOW_REQUEST_LOG')
+}
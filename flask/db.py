@@ -0,0 +1,129 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+
+import config
+import metrics
+from metrics import Histogram
+
+
+class ConnectionPool:
+    def __init__(self, size = None, checkout_timeout = None, health_check_interval = None):
+        """Bounded MySQL connection pool shared by logic.py, Model.py and app.py."""
+        self.size = size or config.db_pool['size']
+        self.checkout_timeout = config.db_pool['checkout_timeout'] if checkout_timeout is None else checkout_timeout
+        self.health_check_interval = config.db_pool['health_check_interval'] if health_check_interval is None else health_check_interval
+        self._pool = None
+        self._init_lock = threading.Lock()
+        # mysql.connector raises at once when the pool is empty; the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._last_checked = {}
+
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.in_use = 0
+        self.wait_ms = Histogram([0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000])
+        self.hold_ms = Histogram([1, 5, 10, 50, 100, 500, 1000, 5000])
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name='car_damage',
+                        pool_size=self.size,
+                        pool_reset_session=False,
+                        **config.credentials
+                    )
+        return self._pool
+
+    def _health_check(self, connection):
+        """Ping connections that have been idle for a while, reconnecting dropped ones."""
+        now = time.monotonic()
+        if now - self._last_checked.get(connection.connection_id, 0) < self.health_check_interval:
+            return
+        if not connection.is_connected():
+            connection.reconnect(attempts=2, delay=0)
+            with self._stats_lock:
+                self.reconnects += 1
+        self._last_checked[connection.connection_id] = now
+
+    @contextmanager
+    def connection(self):
+        """Check out a pooled connection for the duration of a `with` block."""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._stats_lock:
+                self.timeouts += 1
+            raise PoolError(f"Timed out after {self.checkout_timeout}s waiting for a database connection")
+        try:
+            connection = self._get_pool().get_connection()
+            self._health_check(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+        checked_out = time.perf_counter()
+        with self._stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_ms.observe((checked_out - started) * 1000)
+        try:
+            # Queries of logic.py, app.py and the catalog all run inside this block
+            with metrics.span('db'):
+                yield connection
+        finally:
+            try:
+                # Never hand an open transaction to the next caller
+                if connection.in_transaction:
+                    connection.rollback()
+            finally:
+                connection.close()  # returns it to the pool
+                self._slots.release()
+                with self._stats_lock:
+                    self.in_use -= 1
+                    self.hold_ms.observe((time.perf_counter() - checked_out) * 1000)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'reconnects': self.reconnects,
+                'checkout_wait_ms': self.wait_ms.to_dict(),
+                'hold_ms': self.hold_ms.to_dict()
+            }
+
+
+pool = ConnectionPool()
+
+def get_db_connection():
+    """Context manager yielding a pooled connection: `with get_db_connection() as connection:`."""
+    return pool.connection()
+
+def fetchone(query, params = None):
+    with get_db_connection() as connection:
+        with connection.cursor(buffered=True) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+def fetchall(query, params = None):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+def execute(query, params = None):
+    """Run a write statement and commit it. Returns the number of affected rows."""
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            connection.commit()
+            return cursor.rowcount
@@ -0,0 +1,74 @@
+import os
+import time
+
+import config
+import history
+import imaging
+import inference
+import media
+import metrics
+import Model
+
+
+def run_estimate(images, car_brand, car_model, file_prefix = None, progress = None, deadline = None, user_id = None):
+    """Detect, price and render an estimate for one or more decoded photos (or video keyframes) of the same car.
+
+    `progress(stage, fraction)` is called as the estimate advances. If `deadline`
+    (a time.monotonic() value) passes, the estimate stops with TimeoutError.
+    Result images are returned as media store names. With a `user_id` the
+    finished estimate is also queued for the user's history.
+    """
+    def report(stage, fraction):
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Estimate timed out before {stage}")
+        if progress:
+            progress(stage, fraction)
+
+    # Keeping the originals is optional and happens in the background
+    if file_prefix and config.uploads['persist']:
+        for i, image in enumerate(images):
+            # Video keyframes have no upload bytes; the video itself is kept instead
+            if isinstance(image, imaging.UploadedImage):
+                imaging.persist_async(image.data, os.path.join(config.uploads['upload_dir'], f'{file_prefix}_{i}{image.extension}'))
+
+    report('inference', 0.1)
+    # Includes the wait for a batch slot, unlike the model_forward stage
+    with metrics.span('inference'):
+        if len(images) == 1 and not Model.should_tile(images[0]):
+            # Concurrent estimates are micro-batched into a single forward pass
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            predictions = [inference.get_scheduler().predict(images[0], timeout=timeout)]
+        else:
+            # All photos of a claim go through one batched forward pass; tiled
+            # photos are run on their own rather than holding up a shared batch
+            predictions = Model.get_model().predict_batch(images)
+
+    report('pricing', 0.6)
+    claim = Model.ClaimPrediction(predictions, Model.max_counts_for(car_brand, car_model))
+    detected_objects = claim.get_detected_objects()
+    estimated_prices, total_price = claim.predict_price(car_brand, car_model)
+
+    report('rendering', 0.7)
+    extension = imaging.EXTENSIONS[config.rendering['format']]
+    result_images = []
+    for i, prediction in enumerate(predictions):
+        save_path = None
+        if file_prefix and config.uploads['persist']:
+            save_path = os.path.join(config.uploads['output_dir'], f'{file_prefix}_{i}_output{extension}')
+        original_bytes, out_bytes = prediction.plot_image(save_path=save_path)
+        result_images.append((media.store.put(original_bytes, extension), media.store.put(out_bytes, extension)))
+        if progress:
+            progress('rendering', 0.7 + 0.3 * (i + 1) / len(predictions))
+
+    result = {
+        'car_brand': car_brand,
+        'car_model': car_model,
+        'detected_objects': dict(detected_objects),
+        'confidences': claim.get_confidences(),
+        'estimated_prices': estimated_prices,
+        'total_price': total_price,
+        'images': result_images
+    }
+    if user_id and config.history['enabled']:
+        history.writer.record(user_id, result)
+    return result
@@ -3,9 +3,7 @@ from flask_wtf import FlaskForm
 from flask_wtf.form import _Auto
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, FileField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, Optional, Regexp
-from flask_wtf.file import FileAllowed
-import pandas as pd
-from logic import get_car_data
+from flask_wtf.file import FileAllowed, MultipleFileField
 
 class RegistrationForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired(), Length(min=2, max=60)])
@@ -30,30 +28,37 @@ class LoginForm(FlaskForm):
 
 
 class EstimateForm(FlaskForm):
-    brandlist, modellist = get_car_data() # brandlist is of type numpy.ndarray and modellist is of type dict of numpy.ndarray
-    car_brand = SelectField('Car Brand', choices=[(brand, brand) for brand in brandlist], validators=[DataRequired()])
+    # Choices come from the cached price catalog when the form is built for a request
+    car_brand = SelectField('Car Brand', choices=[], validators=[DataRequired()])
     
     submit_car_brand = SubmitField('Next')
     
     car_model = SelectField('Car Model', choices=[], validators=[DataRequired()])
         
-    upload_image = FileField('Upload Image', validators=[FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')], render_kw={
+    # One photo gives a single estimate; several photos of the same car are merged into one claim
+    upload_image = MultipleFileField('Upload Images', validators=[FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')], render_kw={
         'accept': 'image/*', 
         'capture': 'camera', 
-        'multiple': False, 
-        'title': 'Upload an Image', 
+        'multiple': True, 
+        'title': 'Upload one or more Images', 
         'style': 'display: block;', 
         'draggable': True, 
         'ondrop': 'dropHandler(event);', 
         'ondragover': 'dragOverHandler(event);'
     })
+    # A walk-around video is sampled into keyframes and estimated as one claim
+    upload_video = FileField('Or Upload a Walk-Around Video', validators=[Optional(), FileAllowed(['mp4', 'mov', 'm4v', 'avi', 'mkv', 'webm'], 'Videos only!')], render_kw={
+        'accept': 'video/*',
+        'style': 'display: block;'
+    })
     submit = SubmitField('Estimate')
     
     # Dynamically set 'upload_image' required based on which button is pressed
     def __init__(self, *args, **kwargs):
         super(EstimateForm, self).__init__(*args, **kwargs)
-        # if submit button is pressed, set 'upload_image' required to True
-        if request and 'submit' in request.form:
+        # if submit button is pressed without a video, set 'upload_image' required to True
+        video = request.files.get('upload_video') if request else None
+        if request and 'submit' in request.form and not (video and video.filename):
             self.upload_image.validators = [FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!'), DataRequired()]
         else:
             self.upload_image.validators = [FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!'), Optional()]
@@ -92,6 +97,10 @@ class CarDataForm(FlaskForm):
     car_part_price = StringField('Car Part Price', validators=[DataRequired()])
     submit = SubmitField('Add/Update Car Data')
 
+class PriceImportForm(FlaskForm):
+    price_list = FileField('Price List (CSV with brand, model, part, price columns)', validators=[DataRequired(), FileAllowed(['csv'], 'CSV files only!')])
+    submit = SubmitField('Import Prices')
+
 class ContactForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired(), Length(min=2, max=20)])
     email = StringField('Email', validators=[DataRequired(), Email()])
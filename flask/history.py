@@ -0,0 +1,146 @@
+import atexit
+import json
+import threading
+import time
+from queue import Empty, Full, Queue
+
+import config
+import db
+
+INSERT_ESTIMATE = ("INSERT INTO estimates (user_id, car_brand, car_model, detected_objects, confidences, estimated_prices, total_price, images) "
+                   "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+COLUMNS = ('id', 'car_brand', 'car_model', 'detected_objects', 'confidences', 'estimated_prices', 'total_price', 'images', 'created_at')
+JSON_COLUMNS = ('detected_objects', 'confidences', 'estimated_prices', 'images')
+
+
+class EstimateWriter:
+    def __init__(self, batch_size = None, flush_interval = None, max_pending = None):
+        """Record finished estimates from a background thread, several rows per INSERT, off the request path."""
+        self.batch_size = batch_size or config.history['batch_size']
+        self.flush_interval = config.history['flush_interval'] if flush_interval is None else flush_interval
+        self._queue = Queue(maxsize=max_pending or config.history['max_pending'])
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, user_id, result):
+        """Queue an estimate (as returned by estimate.run_estimate) for writing; never blocks the caller."""
+        row = (
+            user_id, result['car_brand'], result['car_model'],
+            json.dumps(result['detected_objects']), json.dumps(result.get('confidences', {})),
+            json.dumps(result['estimated_prices']), result['total_price'], json.dumps(result['images'])
+        )
+        try:
+            self._queue.put_nowait(row)
+        except Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+
+        with self._stats_lock:
+            self.queued += 1
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='estimate-history', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+        return True
+
+    def _collect(self):
+        """Block for the first row, then gather more until the batch is full or the flush interval passes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self._write(self._collect())
+
+    def _write(self, batch):
+        # One retry covers a connection dropped between batches
+        for attempt in range(2):
+            try:
+                with db.get_db_connection() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.executemany(INSERT_ESTIMATE, batch)
+                    connection.commit()
+            except Exception as e:
+                print(f"Could not record {len(batch)} estimate(s) (attempt {attempt + 1}): {e}")
+                continue
+            with self._stats_lock:
+                self.written += len(batch)
+                self.batches += 1
+            return
+        with self._stats_lock:
+            self.failed += len(batch)
+
+    def flush(self):
+        """Write whatever is still queued; called at exit."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'pending': self._queue.qsize(),
+                'queued': self.queued,
+                'written': self.written,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'failed': self.failed
+            }
+
+
+def _from_row(row):
+    estimate = dict(zip(COLUMNS, row))
+    for column in JSON_COLUMNS:
+        value = estimate[column]
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode()
+        estimate[column] = json.loads(value) if isinstance(value, str) else value
+    estimate['total_price'] = float(estimate['total_price'])
+    return estimate
+
+def page(user_id, before = None, limit = None):
+    """A user's estimates, newest first, continuing below the id `before`. Served by the (user_id, id) index."""
+    limit = limit or config.history['page_size']
+    query = f"SELECT {', '.join(COLUMNS)} FROM estimates WHERE user_id = %s"
+    params = [user_id]
+    if before is not None:
+        query += " AND id < %s"
+        params.append(before)
+    query += " ORDER BY id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    rows = db.fetchall(query, tuple(params))
+    estimates = [_from_row(row) for row in rows[:limit]]
+    next_before = estimates[-1]['id'] if len(rows) > limit else None
+    return estimates, next_before
+
+def get(user_id, estimate_id):
+    """One of the user's stored estimates, or None."""
+    row = db.fetchone(f"SELECT {', '.join(COLUMNS)} FROM estimates WHERE id = %s AND user_id = %s", (estimate_id, user_id))
+    return _from_row(row) if row else None
+
+
+writer = EstimateWriter()
@@ -0,0 +1,187 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+import metrics
+
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 of the stored size
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+ALLOWED_FORMATS = ('JPEG', 'PNG')
+
+
+def inspect(data):
+    """Read format, size and EXIF orientation from the image header without decoding the pixels."""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image_format = image.format
+            width, height = image.size
+            orientation = image.getexif().get(0x0112, 1) if image_format == 'JPEG' else 1
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValueError("Could not read the image")
+    return image_format, width, height, orientation
+
+def apply_orientation(array, orientation):
+    """Rotate / flip a decoded array upright according to its EXIF orientation tag."""
+    if orientation == 2:
+        return cv2.flip(array, 1)
+    if orientation == 3:
+        return cv2.rotate(array, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(array, 0)
+    if orientation == 5:
+        return cv2.transpose(array)
+    if orientation == 6:
+        return cv2.rotate(array, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(array), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(array, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return array
+
+
+class UploadedImage:
+    def __init__(self, data, filename = None, target_size = None):
+        """An upload decoded once in memory: the raw bytes plus a BGR array shared by inference and plotting.
+
+        The header is checked before any pixels are decoded. Large JPEGs are
+        decoded directly at a reduced scale close to `target_size` (longest side),
+        unless they are large enough for tiled inference (config.tiling).
+        """
+        self.data = data
+        self.filename = filename
+        name = filename or 'image'
+        if len(data) > config.uploads['max_file_bytes']:
+            raise ValueError(f"{name} is larger than {config.uploads['max_file_bytes'] // (1024 * 1024)} MB")
+
+        self.format, width, height, self.orientation = inspect(data)
+        if self.format not in ALLOWED_FORMATS:
+            raise ValueError(f"{name} is not a JPG or PNG image")
+        if width * height > config.uploads['max_pixels'] or min(width, height) < 1:
+            raise ValueError(f"{name} has an unsupported size ({width}x{height})")
+        self.original_size = (width, height)
+
+        # Photos that will be run as tiles keep their full resolution
+        self.tiled = config.tiling['enabled'] and max(width, height) >= config.tiling['min_side']
+        target_size = target_size or (max(width, height) if self.tiled else config.uploads['decode_target'])
+        self.scale = 1
+        if self.format == 'JPEG':
+            # Largest reduction that still leaves the longest side at or above the target
+            self.scale = max(factor for factor in REDUCED_DECODE_FLAGS if factor == 1 or max(width, height) / factor >= target_size)
+
+        flags = REDUCED_DECODE_FLAGS[self.scale] | cv2.IMREAD_IGNORE_ORIENTATION
+        with metrics.span('image_decode'):
+            array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+            if array is None:
+                raise ValueError(f"Could not decode {name}")
+            if self.format != 'JPEG':
+                array, _ = fit(array, target_size)
+            self.array = apply_orientation(array, self.orientation)
+        self._digest = None
+
+    @property
+    def unchanged(self):
+        """True when the array has the stored size and orientation of the uploaded bytes."""
+        return self.orientation == 1 and self.array.shape[1::-1] == self.original_size
+
+    @property
+    def digest(self):
+        """SHA-256 of the raw upload bytes, cheaper to compute than a hash of the decoded pixels."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def extension(self):
+        extension = os.path.splitext(self.filename or '')[1].lower()
+        return extension if extension in ('.jpg', '.jpeg', '.png') else '.jpg'
+
+    def __str__(self):
+        return self.filename or 'image.jpg'
+
+
+# One colour per class id (BGR), in the spirit of the ultralytics palette
+PALETTE = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+           (10, 249, 72), (23, 204, 146), (134, 219, 61), (211, 188, 0), (209, 99, 255)]
+
+MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+EXTENSIONS = {'jpeg': '.jpg', 'webp': '.webp'}
+
+
+def fit(array, max_dim = None):
+    """Downscale an image so its longest side is at most `max_dim`. Returns the image and the scale used."""
+    max_dim = max_dim or config.rendering['max_dim']
+    height, width = array.shape[:2]
+    scale = min(1.0, max_dim / max(height, width))
+    if scale < 1.0:
+        array = cv2.resize(array, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return array, scale
+
+def draw_boxes(array, boxes, class_names, scale = 1.0):
+    """Draw (x1, y1, x2, y2, conf, cls) rows onto a BGR array in place."""
+    thickness = max(1, round(max(array.shape[:2]) / 400))
+    for x1, y1, x2, y2, conf, cls in boxes:
+        color = PALETTE[int(cls) % len(PALETTE)]
+        p1 = (int(x1 * scale), int(y1 * scale))
+        p2 = (int(x2 * scale), int(y2 * scale))
+        cv2.rectangle(array, p1, p2, color, thickness, cv2.LINE_AA)
+
+        label = f'{class_names[int(cls)]} {conf:.2f}'
+        (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, thickness / 3, max(1, thickness - 1))
+        top = p1[1] - text_height - 4 if p1[1] - text_height - 4 >= 0 else p1[1] + text_height + 4
+        cv2.rectangle(array, (p1[0], top), (p1[0] + text_width, p1[1]), color, -1, cv2.LINE_AA)
+        cv2.putText(array, label, (p1[0], max(p1[1], top) - 2), cv2.FONT_HERSHEY_SIMPLEX, thickness / 3, (255, 255, 255), max(1, thickness - 1), cv2.LINE_AA)
+    return array
+
+def encode(array, image_format = None, quality = None):
+    """Encode a BGR array once as JPEG or WebP."""
+    image_format = image_format or config.rendering['format']
+    quality = quality or config.rendering['quality']
+    with metrics.span('image_encode'):
+        if image_format == 'webp':
+            ok, buffer = cv2.imencode('.webp', array, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        else:
+            ok, buffer = cv2.imencode('.jpg', array, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"Could not encode image as {image_format}")
+    return buffer.tobytes()
+
+def render(array, boxes, class_names, image_format = None, quality = None, max_dim = None):
+    """Downscale, draw the boxes and encode in one pass; the source array is left untouched."""
+    resized, scale = fit(array, max_dim)
+    canvas = resized.copy() if resized is array else resized
+    return encode(draw_boxes(canvas, boxes, class_names, scale), image_format, quality)
+
+def render_original(image, image_format = None, quality = None, max_dim = None):
+    """Encode the original for display, reusing the uploaded bytes when they are already a small enough JPEG."""
+    image_format = image_format or config.rendering['format']
+    max_dim = max_dim or config.rendering['max_dim']
+    array = image.array if isinstance(image, UploadedImage) else image
+    if (isinstance(image, UploadedImage) and image_format == 'jpeg' and image.format == 'JPEG'
+            and image.unchanged and max(array.shape[:2]) <= max_dim):
+        return image.data
+    return encode(fit(array, max_dim)[0], image_format, quality)
+
+# Persisting uploads and outputs is optional and must never delay the response
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-writer')
+
+def _write_file(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+        print(f"Could not save {path}: {e}")
+
+def persist_async(data, path):
+    """Write bytes to `path` on a background thread."""
+    return _writer.submit(_write_file, path, data)
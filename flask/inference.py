@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+import config
+import Model
+from metrics import Histogram
+
+
+class BatchScheduler:
+    def __init__(self, model, max_batch_size = None, max_wait_ms = None):
+        """Collect concurrent inference requests and run them through the model as one batch."""
+        self.model = model
+        self.max_batch_size = max_batch_size or config.inference['max_batch_size']
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else config.inference['max_wait_ms']) / 1000
+        self._queue = Queue()
+
+        # Tuning signals: how deep the queue is when requests arrive, how full
+        # the dispatched batches are and how long requests wait to be batched
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.queue_depth = Histogram([0, 1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 250])
+        self.errors = 0
+
+        # A process-pool model can run one batch per worker process at the same time
+        self.dispatchers = getattr(model, 'processes', 1)
+        self._threads = [threading.Thread(target=self._run, name=f'inference-batcher-{i}', daemon=True) for i in range(self.dispatchers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image):
+        """Queue an image for inference and return a Future resolving to its Prediction."""
+        future = Future()
+        with self._stats_lock:
+            self.queue_depth.observe(self._queue.qsize())
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def predict(self, image, timeout = None):
+        """Submit an image and block until its Prediction is ready."""
+        return self.submit(image).result(timeout)
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait budget is spent."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+                for _, _, queued_at in batch:
+                    self.queue_wait_ms.observe((started - queued_at) * 1000)
+
+            try:
+                predictions = self.model.predict_batch([image for image, _, _ in batch])
+            except Exception as e:
+                print(f"Batch inference error: {e}")
+                with self._stats_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            # Hand each result back to the request that submitted it
+            for (_, future, _), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'dispatchers': self.dispatchers,
+                'queue_depth': self._queue.qsize(),
+                'queue_depth_on_submit': self.queue_depth.to_dict(),
+                'queue_wait_ms': self.queue_wait_ms.to_dict(),
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                'batches': sum(self.batch_sizes.values()),
+                'errors': self.errors
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(start = True):
+    """Return the process-wide BatchScheduler, starting it on first use (or None if `start` is False)."""
+    global _scheduler
+    if _scheduler is None and start:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BatchScheduler(Model.get_model())
+    return _scheduler
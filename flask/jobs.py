@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import config
+import metrics
+
+FINISHED = ('done', 'failed', 'timeout')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, owner):
+        """State of one queued estimate, readable by polling or server-sent events."""
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.finished = None
+        self.version = 0  # bumped on every change so watchers can wait for the next one
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'error': self.error
+        }
+
+
+class JobQueue:
+    def __init__(self, workers = None, max_pending = None, timeout = None, ttl = None):
+        """In-process estimate queue served by a small worker pool, so web workers return at once."""
+        self.workers = workers or config.jobs['workers']
+        self.max_pending = max_pending or config.jobs['max_pending']
+        self.timeout = timeout or config.jobs['timeout']
+        self.ttl = ttl or config.jobs['ttl']
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='estimate-job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    def submit(self, owner, fn, *args, cleanup = None, **kwargs):
+        """Queue `fn(*args, progress=..., deadline=..., **kwargs)` and return its Job.
+
+        `cleanup()` is called once the job has finished, whether it succeeded,
+        failed or timed out before it started, or at once if the queue is full.
+        """
+        with self._changed:
+            self._purge()
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                if cleanup:
+                    cleanup()
+                raise QueueFull(f"{self.pending} estimates are already queued")
+            job = Job(owner)
+            self._jobs[job.id] = job
+            self.pending += 1
+        self._executor.submit(self._run, job, fn, args, kwargs, cleanup)
+        return job
+
+    def _run(self, job, fn, args, kwargs, cleanup = None):
+        # The timeout covers time spent waiting in the queue as well
+        deadline = job.created + self.timeout
+        metrics.start_trace()
+        try:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Estimate timed out while queued")
+            self._update(job, status='running', stage='started')
+            progress = lambda stage, fraction: self._update(job, stage=stage, progress=fraction)
+            result = fn(*args, progress=progress, deadline=deadline, **kwargs)
+        except (TimeoutError, FutureTimeoutError) as e:
+            self._update(job, status='timeout', error=str(e) or 'Estimate timed out')
+        except Exception as e:
+            print(f"Estimate job {job.id} failed: {e}")
+            self._update(job, status='failed', error='The estimate could not be completed.')
+        else:
+            self._update(job, status='done', stage='done', progress=1.0, result=result)
+        finally:
+            seconds = time.monotonic() - job.created
+            metrics.registry.observe('car_damage_job_duration_seconds', seconds, 'Time from queueing to finishing an estimate job.', status=job.status)
+            metrics.finish_trace('job', fn.__name__, seconds, job=job.id, status=job.status)
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"Cleanup of estimate job {job.id} failed: {e}")
+
+    def _update(self, job, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            if job.status in FINISHED and job.finished is None:
+                job.finished = time.monotonic()
+                self.pending -= 1
+                if job.status == 'done':
+                    self.completed += 1
+                elif job.status == 'timeout':
+                    self.timed_out += 1
+                else:
+                    self.failed += 1
+            self._changed.notify_all()
+
+    def _purge(self):
+        """Forget finished jobs older than the ttl. Caller holds the lock."""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished is not None and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def wait(self, job, version, timeout = None):
+        """Block until the job changes past `version` or `timeout` passes; returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: job.version != version, timeout)
+            return job.version
+
+    def stats(self):
+        with self._changed:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'tracked': len(self._jobs),
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'rejected': self.rejected
+            }
+
+
+queue = JobQueue()
@@ -1,11 +1,8 @@
 import regex as re
 import random
 import mysql.connector
-import config
-import pandas as pd
-
-def get_db_connection():
-    return mysql.connector.connect(**config.credentials)
+import users
+from db import get_db_connection
 
 def check_user_exists(email = None, user_id = None):
     query = "SELECT COUNT(*) FROM user_data WHERE email = %s OR user_id = %s"
@@ -15,8 +12,6 @@ def check_user_exists(email = None, user_id = None):
             cursor.execute(query, (email, user_id))
             data = cursor.fetchone()
             return data[0] > 0
-        
-        connection.close()
            
         
 def generate_user_id(name, phone):
@@ -145,7 +140,7 @@ def update_user(user_id, name=None, email=None, password=None, phone=None, addre
                     user_data['car_brand'], user_data['car_model'], user_data['password'], user_data['picture'], user_id
                 ))
                 connection.commit()
-                connection.close()
+                users.cache.invalidate(user_id)
                 print("User updated successfully")
                 return True
 
@@ -162,8 +157,8 @@ def delete_user(user_id):
             with connection.cursor() as cursor:
                 cursor.execute("DELETE FROM user_data WHERE user_id = %s", (user_id,))
                 connection.commit()
+                users.cache.invalidate(user_id)
                 print("User deleted successfully")
-                connection.close()
     except mysql.connector.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
@@ -175,33 +170,9 @@ def send_email(name, email, subject, message):
             with connection.cursor() as cursor:
                 cursor.execute("INSERT INTO message (name, email, subject, message) VALUES (%s, %s, %s, %s)", (name, email, subject, message))
                 connection.commit()
-                connection.close()
                 print("Email sent successfully")
                 
     except mysql.connector.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
         print(f"Unexpected error: {e}")
- 
-
-def get_car_data():
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT brand, model FROM car_data")
-            car_data = cursor.fetchall()
-            car_data = pd.DataFrame(car_data, columns=['brand', 'model'])
-
-            car_data = car_data.sort_values(by=['brand', 'model'])
-            car_data = car_data.reset_index(drop=True)
-            
-            car_brands = car_data['brand'].unique()
-            grouped = car_data.groupby('brand')
-            
-            car_models = {}
-            for brand in car_brands:
-                models = grouped.get_group(brand)['model'].values
-                car_models[brand] = models
-            
-            cursor.close()
-            return car_brands, car_models
-        
\ No newline at end of file
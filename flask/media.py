@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from imaging import MIME_TYPES, encode, persist_async
+
+# Names are `<sha256><extension>`, so a URL always refers to the same bytes and can be cached forever
+NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(jpg|webp)$')
+EXTENSION_MIME_TYPES = {'.jpg': MIME_TYPES['jpeg'], '.webp': MIME_TYPES['webp']}
+
+
+class MediaStore:
+    def __init__(self, directory = None, max_memory_bytes = None, max_disk_bytes = None):
+        """Content-addressed store for result images: a bounded in-memory tier plus files written in the background.
+
+        The files are kept within `max_disk_bytes`, oldest deleted first.
+        """
+        self.directory = directory or config.media['dir']
+        self.max_memory_bytes = max_memory_bytes or config.media['max_memory_bytes']
+        self.max_disk_bytes = max_disk_bytes or config.media['max_disk_bytes']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.disk_bytes = sum(entry.stat().st_size for entry in self._files())
+        self.pruned = 0
+
+    def _files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [entry for subdirectory in os.scandir(self.directory) if subdirectory.is_dir()
+                for entry in os.scandir(subdirectory.path) if entry.is_file() and is_valid_name(entry.name)]
+
+    def path(self, name):
+        # Fan out into sub-directories so no single directory grows too large
+        return os.path.join(self.directory, name[:2], name)
+
+    def put(self, data, extension):
+        """Store encoded image bytes and return their content-addressed name."""
+        name = f'{hashlib.sha256(data).hexdigest()}{extension}'
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = data
+                self.memory_bytes += len(data)
+                while self.memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.memory_bytes -= len(evicted)
+        if not os.path.exists(self.path(name)):
+            persist_async(data, self.path(name)).add_done_callback(lambda _: self._written(len(data)))
+        return name
+
+    def _written(self, size):
+        # Runs on the single upload-writer thread, so prunes never overlap
+        with self._lock:
+            self.disk_bytes += size
+            over_budget = self.disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._prune()
+
+    def _prune(self):
+        """Delete the least recently written images until the files are back under 90% of the budget."""
+        entries = sorted(self._files(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.disk_bytes = total
+            self.pruned += removed
+
+    def get(self, name):
+        """Return the bytes for `name` if they are still held in memory, else None."""
+        with self._lock:
+            data = self._entries.get(name)
+            if data is not None:
+                self._entries.move_to_end(name)
+            return data
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'memory_bytes': self.memory_bytes,
+                    'disk_bytes': self.disk_bytes, 'max_disk_bytes': self.max_disk_bytes, 'pruned': self.pruned}
+
+
+def is_valid_name(name):
+    return NAME_PATTERN.match(name) is not None
+
+def mimetype(name):
+    return EXTENSION_MIME_TYPES[os.path.splitext(name)[1]]
+
+_placeholder = None
+
+def placeholder():
+    """A plain grey JPEG shown in place of images that have been pruned from disk."""
+    global _placeholder
+    if _placeholder is None:
+        _placeholder = encode(np.full((240, 320, 3), 200, dtype=np.uint8), 'jpeg')
+    return _placeholder
+
+
+store = MediaStore()
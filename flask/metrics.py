@@ -0,0 +1,128 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import config
+
+# Prometheus-style latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """Count observations into fixed upper-bound buckets (the last bucket is +Inf)."""
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        labels = [str(b) for b in self.buckets] + ['+Inf']
+        return {'buckets': dict(zip(labels, self.counts)), 'count': self.count, 'sum': round(self.sum, 3)}
+
+    def prometheus(self, name, labels = None):
+        """Lines of the Prometheus text format; bucket counts there are cumulative."""
+        labels = dict(labels or {})
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels({**labels, "le": bound})} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Registry:
+    def __init__(self):
+        """Labelled latency histograms shared by every thread of the worker."""
+        self._lock = threading.Lock()
+        self._help = {}
+        self._series = {}  # (name, labels) -> Histogram
+
+    def observe(self, name, seconds, help_text = '', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = Histogram(LATENCY_BUCKETS)
+                self._help.setdefault(name, help_text)
+            histogram.observe(seconds)
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for (series_name, labels), histogram in sorted(self._series.items()):
+                    if series_name == name:
+                        lines.extend(histogram.prometheus(name, dict(labels)))
+        return lines
+
+
+registry = Registry()
+
+# Per-request breakdown of stage times in milliseconds, set while a request or job is traced
+_trace = ContextVar('trace', default=None)
+
+slow_log = logging.getLogger('car_damage.slow_requests')
+slow_log.propagate = False
+slow_log.addHandler(logging.FileHandler(config.metrics['slow_request_log']) if config.metrics['slow_request_log'] else logging.StreamHandler())
+
+
+def observe_stage(stage, seconds):
+    registry.observe('car_damage_stage_duration_seconds', seconds, 'Time spent in each stage of an estimate or request.', stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage`: `with metrics.span('pricing'):`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def start_trace():
+    """Start collecting a stage breakdown for the current request or job."""
+    _trace.set({})
+
+def finish_trace(kind, name, seconds, **fields):
+    """Stop tracing; if slow-request logging is on and this took too long, log its stage breakdown."""
+    stages = _trace.get() or {}
+    _trace.set(None)
+    threshold = config.metrics['slow_request_ms']
+    if threshold and seconds * 1000 >= threshold:
+        slow_log.warning(json.dumps({
+            'kind': kind,
+            'name': name,
+            'duration_ms': round(seconds * 1000, 1),
+            'stages_ms': {stage: round(ms, 1) for stage, ms in sorted(stages.items(), key=lambda item: -item[1])},
+            **fields
+        }))
+    return stages
+
+
+def sample(name, metric_type, help_text, value):
+    """Text-format lines for a single unlabelled gauge or counter."""
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
@@ -0,0 +1,22 @@
+-- Give car_data a composite unique key on (brand, model, part).
+--
+-- Lookups by brand and model use the index instead of scanning the table, and
+-- `INSERT ... ON DUPLICATE KEY UPDATE` can update an existing price in place.
+-- Existing duplicates are merged first: the row with the lowest id (the price
+-- the estimates already use) is kept and the later copies are deleted.
+--
+--   mysql car_database < flask/migrations/001_car_data_unique_vehicle_part.sql
+
+START TRANSACTION;
+
+DELETE newer
+FROM car_data AS newer
+JOIN car_data AS older
+  ON newer.brand <=> older.brand
+ AND newer.model <=> older.model
+ AND newer.part <=> older.part
+ AND newer.id > older.id;
+
+COMMIT;
+
+ALTER TABLE car_data ADD UNIQUE KEY uq_car_data_vehicle_part (brand, model, part);
@@ -0,0 +1,20 @@
+-- Store finished estimates so users can look them up again without re-running
+-- inference. Rows are written in batches by history.EstimateWriter; the
+-- (user_id, id) index serves the newest-first history pages.
+--
+--   mysql car_database < flask/migrations/002_estimates.sql
+
+CREATE TABLE IF NOT EXISTS `estimates` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `user_id` varchar(10) NOT NULL,
+  `car_brand` varchar(50) NOT NULL,
+  `car_model` varchar(50) NOT NULL,
+  `detected_objects` json NOT NULL,
+  `confidences` json NOT NULL,
+  `estimated_prices` json NOT NULL,
+  `total_price` decimal(12,2) NOT NULL,
+  `images` json NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_estimates_user` (`user_id`, `id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+
+import metrics
+from catalog import price_catalog
+
+
+class PriceMatrix:
+    def __init__(self, index = None):
+        """Dense (vehicle x part) prices for one catalog index. Never modified once built."""
+        # The catalog builds a new index object on every reload, so it identifies the version
+        self.index = index
+        index = index or {}
+        self.vehicles = sorted(index)  # (brand, model) per matrix row
+        self.parts = sorted({part for prices in index.values() for part in prices})  # part name per matrix column
+        self.part_index = {part: i for i, part in enumerate(self.parts)}
+
+        self.prices = np.zeros((len(self.vehicles), len(self.parts)))
+        self.available = np.zeros((len(self.vehicles), len(self.parts)), dtype=bool)
+        for row, vehicle in enumerate(self.vehicles):
+            for part, price in index[vehicle].items():
+                self.prices[row, self.part_index[part]] = price
+                self.available[row, self.part_index[part]] = True
+
+    def count_vector(self, detected_counts):
+        """Convert a part -> count mapping into a vector over the matrix columns."""
+        vector = np.zeros(len(self.parts))
+        for part, count in detected_counts.items():
+            column = self.part_index.get(part)
+            if column is not None:
+                vector[column] = count
+        return vector
+
+
+class PricingEngine:
+    def __init__(self, catalog = price_catalog):
+        """Price matrix built from the price catalog for bulk what-if quotes."""
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        # Replaced as a whole on refresh, so readers always see one consistent version
+        self._matrix = PriceMatrix()
+
+    def matrix(self):
+        """The current PriceMatrix, rebuilt first if the catalog has been reloaded."""
+        index = self.catalog.vehicles()
+        matrix = self._matrix
+        if matrix.index is index:
+            return matrix
+        with self._lock:
+            if self._matrix.index is not index:
+                self._matrix = PriceMatrix(index)
+            return self._matrix
+
+    def quote_many(self, counts_list):
+        """Price many part -> count mappings against every vehicle at once.
+
+        Returns the (estimates x vehicles) array of totals and the vehicles, in
+        column order; row order follows `counts_list`.
+        """
+        matrix = self.matrix()
+        counts = np.array([matrix.count_vector(c) for c in counts_list]).reshape(-1, len(matrix.parts))
+        return counts @ matrix.prices.T, matrix.vehicles
+
+    def rank(self, detected_counts, limit = None, descending = False):
+        """Price one set of damaged parts on every vehicle and return the totals ranked, cheapest first."""
+        with metrics.span('pricing_rank'):
+            matrix = self.matrix()
+            counts = matrix.count_vector(detected_counts)
+            totals = matrix.prices @ counts
+            # Parts that were detected but have no price for a vehicle are priced at 0, so flag them
+            missing = (~matrix.available).astype(np.int64) @ (counts > 0).astype(np.int64)
+
+            order = np.argsort(-totals if descending else totals, kind='stable')
+            if limit:
+                order = order[:limit]
+
+        return [{
+            'brand': matrix.vehicles[i][0],
+            'model': matrix.vehicles[i][1],
+            'total': float(totals[i]),
+            'missing_parts': int(missing[i])
+        } for i in order]
+
+
+pricing_engine = PricingEngine()
@@ -0,0 +1,160 @@
+import base64
+import csv
+import io
+import json
+
+import config
+import db
+
+# Admin listings. Identifiers only ever come from here, never from the request.
+# `sortable` maps a column to the expression it is ordered by; NULLs are folded
+# into a value so the keyset comparison stays well defined.
+TABLES = {
+    'users': {
+        'table': 'user_data',
+        'key': 'user_id',
+        # Password hashes are neither listed nor exported
+        'columns': ('user_id', 'name', 'email', 'phone_number', 'address', 'city', 'state', 'zipcode', 'country',
+                    'registration_date', 'car_brand', 'car_model', 'is_admin', 'profile_pic'),
+        'sortable': {'user_id': 'user_id', 'name': 'name', 'email': 'email', 'city': 'city', 'country': 'country',
+                     'registration_date': "COALESCE(registration_date, '1970-01-01 00:00:00')"},
+        'filters': ('city', 'state', 'country', 'car_brand', 'car_model', 'is_admin'),
+        'search': ('user_id', 'name', 'email')
+    },
+    'car_data': {
+        'table': 'car_data',
+        'key': 'id',
+        'columns': ('id', 'brand', 'model', 'part', 'price'),
+        'sortable': {'id': 'id', 'brand': "COALESCE(brand, '')", 'model': "COALESCE(model, '')",
+                     'part': "COALESCE(part, '')", 'price': 'COALESCE(price, 0)'},
+        'filters': ('brand', 'model', 'part'),
+        'search': ('brand', 'model', 'part')
+    },
+    'messages': {
+        'table': 'message',
+        'key': 'id',
+        'columns': ('id', 'name', 'email', 'subject', 'message', 'date'),
+        'sortable': {'id': 'id', 'date': "COALESCE(date, '1970-01-01 00:00:00')", 'name': 'name', 'email': 'email'},
+        'filters': ('email',),
+        'search': ('name', 'email', 'subject')
+    }
+}
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid page cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid page cursor")
+    return values
+
+
+class TableQuery:
+    def __init__(self, name, args):
+        """One page (or a full export) of an admin table, filtered and sorted in SQL from the query string."""
+        self.name = name
+        self.spec = TABLES[name]
+        self.sort = args.get('sort', self.spec['key'])
+        if self.sort not in self.spec['sortable']:
+            raise ValueError(f"Cannot sort by '{self.sort}'")
+        self.descending = args.get('order') == 'desc'
+        self.search = args.get('q', '').strip()
+        self.filters = {column: args[column] for column in self.spec['filters'] if args.get(column)}
+        self.limit = min(max(1, args.get('limit', config.admin['page_size'], type=int) or 1), config.admin['max_page_size'])
+        self.after = decode_cursor(args['after']) if args.get('after') else None
+
+    def args(self, **changes):
+        """Query string arguments reproducing this listing, with `changes` applied."""
+        args = {'sort': self.sort, 'order': 'desc' if self.descending else 'asc', 'limit': self.limit, **self.filters}
+        if self.search:
+            args['q'] = self.search
+        args.update(changes)
+        return {name: value for name, value in args.items() if value not in (None, '')}
+
+    def _select(self, limit = None):
+        spec = self.spec
+        key = spec['key']
+        expression = spec['sortable'][self.sort]
+        clauses, params = [], []
+
+        for column, value in self.filters.items():
+            clauses.append(f'{column} = %s')
+            params.append(value)
+
+        if self.search:
+            pattern = '%' + self.search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append('(' + ' OR '.join(f'{column} LIKE %s' for column in spec['search']) + ')')
+            params += [pattern] * len(spec['search'])
+
+        # Keyset pagination: continue after the (sort value, key) of the last row shown
+        if self.after is not None:
+            sort_value, key_value = self.after
+            op = '<' if self.descending else '>'
+            if expression == key:
+                clauses.append(f'{key} {op} %s')
+                params.append(key_value)
+            else:
+                clauses.append(f'({expression} {op} %s OR ({expression} = %s AND {key} {op} %s))')
+                params += [sort_value, sort_value, key_value]
+
+        direction = 'DESC' if self.descending else 'ASC'
+        query = f"SELECT {', '.join(spec['columns'])}, {expression} FROM {spec['table']}"
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += f' ORDER BY {expression} {direction}, {key} {direction}'
+        if limit:
+            query += ' LIMIT %s'
+            params.append(limit)
+        return query, tuple(params)
+
+    def page(self):
+        """Return this page's rows as dicts and the cursor of the next page (None on the last page)."""
+        rows = db.fetchall(*self._select(self.limit + 1))
+        columns = self.spec['columns']
+        key_index = columns.index(self.spec['key'])
+        next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            next_cursor = encode_cursor([rows[-1][-1], rows[-1][key_index]])
+        return [dict(zip(columns, row)) for row in rows], next_cursor
+
+    def stream(self, export_format):
+        """Yield the whole filtered table as CSV or NDJSON, a batch of rows at a time.
+
+        The cursor is unbuffered, so rows are read from the server as they are
+        written out and memory stays flat however large the table is.
+        """
+        query, params = self._select()
+        columns = self.spec['columns']
+        batch_size = config.admin['export_batch_size']
+
+        def encode(rows):
+            if export_format == 'ndjson':
+                return ''.join(json.dumps(dict(zip(columns, row[:len(columns)])), default=str) + '\n' for row in rows)
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(row[:len(columns)] for row in rows)
+            return buffer.getvalue()
+
+        with db.get_db_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            finished = False
+            try:
+                if export_format == 'csv':
+                    yield encode([columns])
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        finished = True
+                        break
+                    yield encode(rows)
+            finally:
+                if not finished:
+                    # An abandoned download must not leave unread rows on a pooled connection
+                    connection.consume_results()
+                cursor.close()
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class UserCache:
+    def __init__(self, ttl = None, max_entries = None):
+        """Bounded TTL cache of logged-in users, so load_user does not query user_data on every request."""
+        self.ttl = config.users['cache_ttl'] if ttl is None else ttl
+        self.max_entries = max_entries or config.users['max_entries']
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+        self._generations = {}  # user_id -> number of invalidations, to spot loads they overtook
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.session_hits = 0
+        self.invalidations = 0
+
+    def get(self, user_id, load):
+        """Return the cached user for `user_id`, calling `load(user_id)` on a miss. Unknown users are not cached."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generations.get(user_id, 0)
+
+        user = load(user_id)
+        if user is not None and self.ttl:
+            with self._lock:
+                # Invalidated while loading: the row may have changed after it was read, so do not keep it
+                if self._generations.get(user_id, 0) != generation:
+                    return user
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def record_session_hit(self):
+        with self._lock:
+            self.session_hits += 1
+
+    def invalidate(self, user_id):
+        """Forget a user after their row changed; other workers catch up within the ttl."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.session_hits
+            return {
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'session_hits': self.session_hits,
+                'invalidations': self.invalidations,
+                'hit_ratio': round((self.hits + self.session_hits) / lookups, 4) if lookups else None
+            }
+
+
+cache = UserCache()
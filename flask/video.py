@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+import config
+import estimate
+import imaging
+import metrics
+
+VIDEO_EXTENSIONS = ('mp4', 'mov', 'm4v', 'avi', 'mkv', 'webm')
+
+
+def frame_hash(array):
+    """64-bit difference hash of a frame; near-identical frames differ in only a few bits."""
+    small = cv2.resize(array, (9, 8), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+    return int.from_bytes(np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def save_upload(upload):
+    """Stream an uploaded video into a temporary file, since OpenCV decodes from a path. Returns the path."""
+    extension = os.path.splitext(upload.filename or '')[1].lower()
+    handle, path = tempfile.mkstemp(prefix='claim-video-', suffix=extension if extension[1:] in VIDEO_EXTENSIONS else '.mp4')
+    with os.fdopen(handle, 'wb') as f:
+        upload.save(f)
+    return path
+
+
+def discard(path):
+    """Remove a saved video if it is still there; safe to call more than once."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sample_keyframes(path, min_interval = None, max_interval = None, dedup_distance = None, max_keyframes = None):
+    """Pick distinct keyframes from a video, reading it front to back as a stream.
+
+    Frames between samples are only grabbed, never retrieved, so they are not
+    converted to BGR or copied. The sampling interval doubles (up to
+    `max_interval`) while sampled frames repeat a keyframe already taken and
+    halves again when the view changes. A frame is a repeat when its difference
+    hash is within `dedup_distance` bits of a keyframe's. Returns the keyframes
+    as BGR arrays no larger than config.video['frame_max_dim'], and sampling stats.
+    """
+    min_interval = min_interval or config.video['min_interval']
+    max_interval = max_interval or config.video['max_interval']
+    dedup_distance = config.video['dedup_distance'] if dedup_distance is None else dedup_distance
+    max_keyframes = max_keyframes or config.video['max_keyframes']
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Could not read the video")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    fps = fps if 0 < fps < 1000 else 30.0
+    last_frame = int(config.video['max_duration'] * fps)
+    duration = min(capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps, config.video['max_duration'])
+    # Spread the keyframe budget over the whole video rather than spending it on the start
+    min_interval = min(max_interval, max(min_interval, duration / max_keyframes))
+
+    keyframes = []
+    hashes = []
+    interval = min_interval
+    stats = {'fps': round(fps, 2), 'frames_read': 0, 'sampled': 0, 'duplicates': 0, 'keyframes': 0, 'timestamps': []}
+    index = 0
+    next_sample = 0
+    try:
+        with metrics.span('video_decode'):
+            while index <= last_frame and len(keyframes) < max_keyframes and capture.grab():
+                if index == next_sample:
+                    ok, frame = capture.retrieve()
+                    if ok:
+                        stats['sampled'] += 1
+                        frame = imaging.fit(frame, config.video['frame_max_dim'])[0]
+                        frame_digest = frame_hash(frame)
+                        if any(hamming(frame_digest, seen) <= dedup_distance for seen in hashes):
+                            stats['duplicates'] += 1
+                            interval = min(max_interval, interval * 2)
+                        else:
+                            keyframes.append(frame)
+                            hashes.append(frame_digest)
+                            stats['timestamps'].append(round(index / fps, 2))
+                            interval = max(min_interval, interval / 2)
+                    next_sample = index + max(1, round(interval * fps))
+                index += 1
+    finally:
+        capture.release()
+
+    stats['frames_read'] = index
+    stats['keyframes'] = len(keyframes)
+    if not keyframes:
+        raise ValueError("No frames could be decoded from the video")
+    return keyframes, stats
+
+
+def run_video_estimate(path, car_brand, car_model, file_prefix = None, progress = None, deadline = None, user_id = None):
+    """Estimate a claim from a walk-around video saved at `path`.
+
+    The selected keyframes go through estimate.run_estimate as one claim, so
+    they share a batched forward pass and a single merged price breakdown. The
+    video is moved to the uploads folder when uploads are persisted, otherwise
+    deleted.
+    """
+    try:
+        if progress:
+            progress('sampling', 0.0)
+        keyframes, stats = sample_keyframes(path)
+    finally:
+        if file_prefix and config.uploads['persist']:
+            os.makedirs(config.uploads['upload_dir'], exist_ok=True)
+            try:
+                shutil.move(path, os.path.join(config.uploads['upload_dir'], f'{file_prefix}_video{os.path.splitext(path)[1]}'))
+            except OSError as e:
+                print(f"Could not save {path}: {e}")
+        else:
+            discard(path)
+
+    result = estimate.run_estimate(keyframes, car_brand, car_model, file_prefix=file_prefix, progress=progress,
+                                   deadline=deadline, user_id=user_id)
+    result['video'] = stats
+    return result
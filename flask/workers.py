@@ -0,0 +1,219 @@
+import atexit
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from queue import Empty
+
+import numpy as np
+
+import backends
+import config
+from cache import InferenceCache
+from imaging import UploadedImage
+from Model import MAX_COUNTS, YOLOModel
+
+
+def _attach(item):
+    """Turn a task item back into a model input; shared-memory arrays are viewed, not copied."""
+    if item[0] == 'path':
+        return item[1], None
+    _, name, shape, dtype = item
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+def _worker_main(model_path, threads, warmup_size, tasks, results):
+    """Entry point of an inference process: load the weights once, then serve batches until told to stop."""
+    try:
+        import torch
+        from ultralytics import YOLO
+
+        torch.set_num_threads(threads)
+        model = YOLO(model_path, task='detect')
+        model(np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8), verbose=False)
+    except Exception as e:
+        # Tell the parent why, instead of leaving it to wait for the startup timeout
+        results.put(('failed', os.getpid(), repr(e)))
+        return
+    results.put(('ready', os.getpid(), model.names))
+
+    # Segments the predictor may still reference are closed on a later task
+    stale = []
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, items = task
+        handles = []
+        try:
+            inputs = []
+            for item in items:
+                array, shm = _attach(item)
+                inputs.append(array)
+                if shm is not None:
+                    handles.append(shm)
+            outputs = model(inputs, batch=len(inputs), verbose=False)
+            boxes = [output.boxes.data.cpu().numpy() for output in outputs]
+            del inputs, outputs
+            results.put((task_id, boxes, None))
+        except Exception as e:
+            results.put((task_id, None, repr(e)))
+
+        for shm in stale + handles:
+            try:
+                shm.close()
+            except BufferError:
+                continue
+        stale = [shm for shm in stale + handles if shm.buf is not None]
+
+
+class ProcessPoolYOLOModel(YOLOModel):
+    def __init__(self, model_path = None, processes = None, threads = None):
+        """YOLOModel whose forward passes run in a pool of worker processes, one loaded model each."""
+        self.model_path = model_path or backends.resolve_weights()
+        self.processes = processes or config.worker_pool['processes'] or os.cpu_count()
+        self.threads = threads or config.worker_pool['threads'] or max(1, (os.cpu_count() or 1) // self.processes)
+        self.max_counts = dict(MAX_COUNTS)
+        self.weights_version = backends.weights_version(self.model_path)
+        self.cache = InferenceCache() if config.inference_cache['enabled'] else None
+        self._lock = threading.Lock()
+
+        # Spawn rather than fork: forking a process that already runs torch threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(target=_worker_main, name=f'inference-worker-{i}', daemon=True,
+                            args=(self.model_path, self.threads, config.yolo['warmup_size'], self._tasks, self._results))
+            for i in range(self.processes)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._wait_ready(config.worker_pool['startup_timeout'])
+
+        self._task_ids = itertools.count()
+        self._pending = {}
+        self.tasks_sent = 0
+        self.images_sent = 0
+        self._collector = threading.Thread(target=self._collect, name='inference-results', daemon=True)
+        self._collector.start()
+        atexit.register(self.close)
+
+    def _wait_ready(self, timeout):
+        """Wait for every worker to report its class names once its weights are loaded and warmed.
+
+        If a worker fails or dies first, or `timeout` passes, all workers are
+        stopped and RuntimeError is raised.
+        """
+        deadline = time.monotonic() + timeout
+        ready = 0
+        error = None
+        while ready < len(self._workers):
+            try:
+                status, pid, payload = self._results.get(timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+            except Empty:
+                dead = [worker for worker in self._workers if not worker.is_alive()]
+                if dead:
+                    error = f"{dead[0].name} exited with code {dead[0].exitcode} while loading {self.model_path}"
+                elif time.monotonic() >= deadline:
+                    error = f"{len(self._workers) - ready} worker(s) did not load {self.model_path} within {timeout}s"
+                else:
+                    continue
+                break
+            if status == 'failed':
+                error = f"Inference worker {pid} could not load {self.model_path}: {payload}"
+                break
+            self.class_names = payload
+            ready += 1
+
+        if error:
+            self._stop_workers()
+            raise RuntimeError(error)
+
+    def _stop_workers(self):
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self._workers:
+            worker.join(timeout=5)
+
+    def warmup(self, size = None):
+        """Workers warm up when they start."""
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, boxes, error = self._results.get()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(task_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(f"Inference worker failed: {error}"))
+            else:
+                future.set_result(boxes)
+
+    def _share(self, image):
+        """Copy a decoded image into a new shared memory segment; paths are sent as-is."""
+        array = image.array if isinstance(image, UploadedImage) else image
+        if not isinstance(array, np.ndarray):
+            return ('path', str(array)), None
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        return ('shm', shm.name, array.shape, array.dtype.str), shm
+
+    def _forward(self, images):
+        """Split the batch across the worker processes and rebuild Results from the returned boxes."""
+        chunks = [chunk for chunk in np.array_split(np.arange(len(images)), min(len(images), self.processes)) if len(chunk)]
+        segments = []
+        futures = []
+        try:
+            for chunk in chunks:
+                items = []
+                for i in chunk:
+                    item, shm = self._share(images[i])
+                    items.append(item)
+                    if shm is not None:
+                        segments.append(shm)
+                future = Future()
+                with self._lock:
+                    task_id = next(self._task_ids)
+                    self._pending[task_id] = future
+                    self.tasks_sent += 1
+                    self.images_sent += len(items)
+                self._tasks.put((task_id, items))
+                futures.append(future)
+
+            boxes = []
+            for future in futures:
+                # A worker that died mid-task never answers, so do not wait forever
+                boxes.extend(future.result(timeout=config.worker_pool['task_timeout']))
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+        return [self._results_from_boxes(image, image_boxes) for image, image_boxes in zip(images, boxes)]
+
+    def close(self):
+        for _ in self._workers:
+            try:
+                self._tasks.put(None)
+            except (OSError, ValueError):
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'threads_per_process': self.threads,
+                'alive': sum(worker.is_alive() for worker in self._workers),
+                'tasks_sent': self.tasks_sent,
+                'images_sent': self.images_sent,
+                'pending_tasks': len(self._pending)
+            }